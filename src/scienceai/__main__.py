@@ -1,10 +1,11 @@
-import asyncio
+import base64
+import gzip
+import io
 import re
 import os
 import shutil
 import sys
 import threading
-import time
 import urllib
 import uuid
 import zipfile
@@ -12,12 +13,14 @@ import tempfile
 
 from flask_sock import Sock
 from flask import Flask, render_template, abort, after_this_request
-from .database_manager import DatabaseManager, get_projects
-from .backend import run_backend
-from multiprocessing import Queue
+from .database_manager import DatabaseManager, get_projects, STORAGE_ENGINES, STORAGE_ENGINE_VARIABLE
+from .checkpoint_store import CHECKPOINT_STORE
+from .zip_stream import stream_zip, folder_entries
+from .backend import BackendProcess
 import atexit
 from datetime import datetime
-from .llm import client
+from .llm import client, scheduler, openai_key
+from .rate_budget import start_shared_rate_budget
 
 app = Flask(__name__,
             template_folder='templates',
@@ -25,11 +28,7 @@ app = Flask(__name__,
 sock = Sock(app)
 
 
-database = None
-stop_event = None
-message_queue = None
-thread = None
-original_save = None
+rate_budget = None
 db_folder = os.path.join(os.path.expanduser('~'), 'Documents', "ScienceAI")
 if not os.path.exists(db_folder):
     os.makedirs(db_folder)
@@ -38,21 +37,62 @@ path_to_python = sys.executable
 script_to_return_to_menu = "<script>window.location.href = '/menu';</script>"
 
 
-def close():
-    global thread
-    global stop_event
-    global message_queue
-    global database
-    global original_save
-    if thread:
-        message_queue.put({"TERMINATE": True})
-        stop_event.set()
-        thread.join()
-    thread = None
-    stop_event = None
-    message_queue = None
-    database = None
-    original_save = None
+# the browser names the project it works on in this cookie, so several projects can be open at once
+PROJECT_COOKIE = "project"
+
+
+class OpenProject:
+    """ A project served by this process, its backend and the read only database view the routes read from """
+    def __init__(self, name, backend, database):
+        self.name = name
+        self.backend = backend
+        self.database = database
+        self.original_save = database.get_last_save()
+
+    def close(self):
+        self.backend.stop()
+
+
+# open projects keyed by project path
+open_projects = {}
+open_projects_lock = threading.Lock()
+loading_locks = {}
+
+
+def project_key(project):
+    return os.path.join(db_folder, "scienceai_db", project)
+
+
+def current_project():
+    """ Returns the open project the request's browser works on, None if it has none open """
+    from flask import request
+    project = request.cookies.get(PROJECT_COOKIE)
+    if not project:
+        return None
+    return open_projects.get(project_key(project))
+
+
+def open_app(project):
+    """ Sends the browser to the app for this project """
+    from flask import redirect
+    response = redirect('/app')
+    response.set_cookie(PROJECT_COOKIE, project, samesite="Lax")
+    return response
+
+
+def close(project):
+    with open_projects_lock:
+        open_project = open_projects.pop(project_key(project), None)
+    if open_project:
+        open_project.close()
+
+
+def close_all():
+    with open_projects_lock:
+        projects = list(open_projects.values())
+        open_projects.clear()
+    for open_project in projects:
+        open_project.close()
     for file in os.listdir(os.path.join(path_to_app, "io")):
         os.remove(os.path.join(path_to_app, "io", file))
 
@@ -67,28 +107,42 @@ app.jinja_env.filters['sanitize_for_id'] = sanitize_for_id
 app.jinja_env.filters['quote_url'] = lambda u: urllib.parse.quote(u)
 
 
+def shared_rate_budget():
+    """ One LLM rate budget for every backend this app starts, kept in a manager process """
+    global rate_budget
+    if rate_budget is None:
+        manager, rate_budget = start_shared_rate_budget(scheduler.budget.requests_per_minute,
+                                                        scheduler.budget.tokens_per_minute)
+        atexit.register(manager.shutdown)
+    return rate_budget
+
+
 def load_project(project):
-    global stop_event
-    global database
-    global message_queue
-    global thread
-    global original_save
-    for file in os.listdir(os.path.join(path_to_app, "io")):
-        os.remove(os.path.join(path_to_app, "io", file))
-    if database:
-        close()
-        return False
-    stop_event = threading.Event()
-    message_queue = Queue()
-    ingest_folder = os.path.join(db_folder, "scienceai_db", project, project.replace(" ", "_")+"_ingest_folder")
-    if not os.path.exists(ingest_folder):
-        return False
-    thread = threading.Thread(target=run_backend, args=(ingest_folder, project, db_folder, message_queue, stop_event))
-    thread.start()
-    time.sleep(1)
-    database = DatabaseManager(ingest_folder, None, project, storage_path=db_folder, read_only_mode=True)
-    original_save = database.get_last_save()
-    return True
+    """ Opens the project unless it is already open, returns whether it is open """
+    key = project_key(project)
+    with open_projects_lock:
+        if key in open_projects:
+            return True
+        loading_lock = loading_locks.setdefault(key, threading.Lock())
+    # a slow start of one project does not hold up requests for the others
+    with loading_lock:
+        if key in open_projects:
+            return True
+        ingest_folder = os.path.join(db_folder, "scienceai_db", project, project.replace(" ", "_")+"_ingest_folder")
+        if not os.path.exists(ingest_folder):
+            return False
+        backend = BackendProcess(ingest_folder, project, db_folder, rate_budget=shared_rate_budget(),
+                                 openai_key=openai_key)
+        if not backend.start():
+            print(backend.error)
+            backend.stop()
+            return False
+        # the backend writes from another process, so this read only view watches the change files
+        database = DatabaseManager(ingest_folder, None, project, storage_path=db_folder, read_only_mode=True,
+                                   watch_changes=True)
+        with open_projects_lock:
+            open_projects[key] = OpenProject(project, backend, database)
+        return True
 
 
 @app.route('/', methods=['GET', 'POST'])
@@ -100,10 +154,9 @@ def menu():
         if "project" in request.form:
             project = request.form["project"]
             if project in projects:
-                close()
                 result = load_project(project)
                 if result:
-                    return redirect('/app')
+                    return open_app(project)
                 return redirect('/menu?error=Folder%20not%20found')
             else:
                 return redirect('/create?project='+project)
@@ -164,7 +217,7 @@ def create_project():
                 return redirect('/menu?error=No%20files%20uploaded')
             result = load_project(project)
             if result:
-                return redirect('/app')
+                return open_app(project)
             return redirect('/menu?error=Failed%20to%20create%20project')
     return redirect('/menu?error=Failed%20to%20Create%20Project')
 
@@ -172,15 +225,17 @@ def create_project():
 @app.route('/app')
 def app_endpoint():
     from flask import redirect
-    if database:
+    if current_project():
         return render_template('app.html')
     return redirect('/menu?error=No%20project%20loaded')
 
 
 @app.route('/start-database')
 def db():
-    if not database:
+    open_project = current_project()
+    if not open_project:
         return script_to_return_to_menu
+    database = open_project.database
     db_snippet = database.get_analyst_data_visual("/")
     html_snippet = render_template('db_element.html', data_dict=db_snippet, basepath="Analysts")
     return render_template('db.html', html_snippet=html_snippet)
@@ -190,8 +245,10 @@ def db():
 @app.route('/Analysts/<path:path>')
 def update_data(path):
     from urllib.parse import unquote
-    if not database:
+    open_project = current_project()
+    if not open_project:
         return script_to_return_to_menu
+    database = open_project.database
     path = unquote(path)
     if path == "/Analysts":
         data_to_return = database.get_analyst_data_visual("/")
@@ -205,43 +262,70 @@ def update_data(path):
 
 @app.route('/download/<path:filepath>')
 def download(filepath):
-    from flask import send_from_directory, request
+    from flask import send_file, request
+    open_project = current_project()
+    if not open_project:
+        return abort(404, description="Resource not found")
+    database = open_project.database
     filepath = urllib.parse.unquote(filepath)
     if filepath[0] != '/' and not sys.platform.startswith("win"):
         filepath = "/"+filepath
-    target = os.path.join(path_to_app, "io", os.path.basename(filepath))
-    shutil.copyfile(filepath, target)
+    # files are served in place, so only files inside the open project may be requested
+    project_path = os.path.realpath(database.project_path)
+    if os.path.commonpath([os.path.realpath(filepath), project_path]) != project_path:
+        return abort(404, description="Resource not found")
+    filepath = database.materialize(filepath)
+    if not os.path.isfile(filepath):
+        return abort(404, description="Resource not found")
+    # conditional responses answer Range requests and revalidate with ETag and Last-Modified
+    return send_file(filepath, as_attachment=bool(request.args.get("attached")), conditional=True, etag=True)
 
-    @after_this_request
-    def remove_file(response):
-        if not sys.platform.startswith("win"):
-            os.remove(target)
-        return response
-    dir_path = os.path.dirname(target)
-    path = os.path.basename(filepath)
-    if request.args.get("attached"):
-        return send_from_directory(directory=dir_path, path=path, as_attachment=True)
-    else:
-        return send_from_directory(directory=dir_path, path=path, as_attachment=False)
+
+@app.route('/page_image/<paper_id>/<int:page>')
+def page_image(paper_id, page):
+    from flask import send_file
+    open_project = current_project()
+    if not open_project:
+        return script_to_return_to_menu
+    database = open_project.database
+    try:
+        refs = database.get_page_images(paper_id, as_data_url=False)
+    except ValueError:
+        return abort(404, description="Resource not found")
+    if page < 1 or page > len(refs):
+        return abort(404, description="Resource not found")
+    ref = refs[page - 1]
+    if ref.startswith("data:"):
+        header, encoded = ref.split(",", 1)
+        return send_file(io.BytesIO(base64.b64decode(encoded)), mimetype=header[len("data:"):].split(";")[0])
+    return send_file(ref)
 
 
 @sock.route('/discussion')
 def discussion(ws):
-    if not database:
+    open_project = current_project()
+    if not open_project:
         return script_to_return_to_menu
-    messages = database.get_database_chat()
-    if len(messages) == 0:
-        current = str(uuid.uuid4())
-    else:
-        current = str(hash(str(database.get_database_chat())))
-        ws.send(render_template('chat.html', messages=messages))
-    while True:
-        asyncio.run(database.await_update(timeout=60))
-        messages = database.get_database_chat()
-        new = str(hash(str(database.get_database_chat())))
-        if new != current:
-            current = new
-            ws.send(render_template('chat.html', messages=messages))
+    database = open_project.database
+    # only messages added or updated since the last version sent are rendered, as out of band swaps
+    version = 0
+    count = 0
+    updates = database.changes.versions()
+    # the loop ends once the project is closed, the client then reconnects to the menu
+    while open_projects.get(project_key(open_project.name)) is open_project:
+        version, changes, complete = database.get_chat_since(version)
+        if complete:
+            messages = [message for index, message in changes]
+            if messages:
+                ws.send(render_template('chat.html', messages=messages))
+            count = len(messages)
+        elif changes:
+            changed = [(index, message) for index, message in changes if index < count]
+            added = [(index, message) for index, message in changes if index >= count]
+            count += len(added)
+            ws.send(render_template('chat_delta.html', changed=changed, added=added,
+                                    last_message=database.get_last_message()))
+        updates = database.wait_for_update(updates, collections=["chat"], timeout=60)
 
 
 @app.route('/send_message', methods=['POST'])
@@ -250,48 +334,57 @@ def send_message():
     message = request.form['text']
     new = {"content": message, "time": datetime.now().strftime('%B %d, %Y %I:%M:%S %p %Z'), "role": "user",
                        "status": "Pending"}
-    message_queue.put(new)
+    open_project = current_project()
+    if not open_project:
+        return script_to_return_to_menu
+    open_project.backend.send_message(new)
     return render_template('chat_update.html')
 
 
 @sock.route('/papers')
 def papers(ws):
-    if not database:
+    open_project = current_project()
+    if not open_project:
         return script_to_return_to_menu
-    papers_dict = database.get_database_papers()
-    if len(papers_dict) == 0:
-        current = str(uuid.uuid4())
-    else:
-        current = str(hash(str(database.get_database_papers())))
-        ws.send(render_template('papers.html', papers=papers_dict))
-    while True:
-        asyncio.run(database.await_update(timeout=60))
-        new = str(hash(str(database.get_database_papers())))
-        if new != current:
-            papers_dict = database.get_database_papers()
-            current = new
-            ws.send(render_template('papers.html', papers=papers_dict))
+    database = open_project.database
+    version = 0
+    shown = set()
+    updates = database.changes.versions()
+    while open_projects.get(project_key(open_project.name)) is open_project:
+        version, papers_list, removed, complete = database.get_papers_since(version)
+        if complete:
+            if papers_list:
+                ws.send(render_template('papers.html', papers=papers_list))
+            shown = {paper["paper_id"] for paper in papers_list}
+        elif papers_list or removed:
+            changed = [paper for paper in papers_list if paper["paper_id"] in shown]
+            added = [paper for paper in papers_list if paper["paper_id"] not in shown]
+            removed = [paper_id for paper_id in removed if paper_id in shown]
+            shown.update(paper["paper_id"] for paper in added)
+            shown.difference_update(removed)
+            ws.send(render_template('papers_delta.html', changed=changed, added=added, removed=removed))
+        updates = database.wait_for_update(updates, collections=["papers"], timeout=60)
 
 
 @app.route('/close_project')
 def close_project():
     from flask import redirect, render_template, request
+    open_project = current_project()
     if request.args.get("confirm"):
-        global database
-        global message_queue
-        if database:
-            close()
-        database = None
-        message_queue = None
-        return redirect('/menu')
+        response = redirect('/menu')
+        if open_project:
+            close(open_project.name)
+        response.delete_cookie(PROJECT_COOKIE)
+        return response
     last_save = None
-    if database:
+    if open_project:
+        database = open_project.database
         last_save = database.get_last_save()
         if not last_save:
             ready = False
         else:
             update_time = database.get_update_time().replace(" ", "_").replace(":", "_")
-            ready = last_save.find(update_time) > -1 or last_save == original_save
+            ready = last_save.find(update_time) > -1 or last_save == open_project.original_save
         messages = database.get_database_chat()
         option = False
         if len(messages) > 0:
@@ -307,12 +400,21 @@ def close_project():
         return render_template('close.html', last_save=pretty_time, ready=ready, option=option)
 
 
+def zip_response(entries, zip_name):
+    """ Streams a zip of the (archive name, path) entries to the client while it is being built """
+    from flask import Response
+    return Response(stream_zip(entries), mimetype="application/zip",
+                    headers={"Content-Disposition": "attachment; filename=" + urllib.parse.quote(zip_name)})
+
+
 @app.route('/export_papers')
 def export_papers():
-    from flask import send_from_directory, request
+    from flask import request
     from urllib.parse import unquote, quote
-    if not database:
+    open_project = current_project()
+    if not open_project:
         return script_to_return_to_menu
+    database = open_project.database
     analystName = request.args.get("analyst", "")
     listName = request.args.get("list", "")
     if len(analystName)+len(listName) == 0:
@@ -322,9 +424,8 @@ def export_papers():
         papers = database.get_all_papers(analyst=analystName, named_list=listName)
     except ValueError:
         return abort(404, description="Resource not found")
-    temp_dir = tempfile.mktemp()
-    temp_path = os.path.join(temp_dir, "scienceai_paper_export_"+datetime.now().strftime('%Y-%m-%d_%H-%M-%S'))
-    os.makedirs(temp_path, exist_ok=True)
+    export_name = "scienceai_paper_export_"+datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+    entries = [(export_name, database.papers_pdf_path)]
     selected_fields = unquote(request.args.get("fields")).split(",")
     sep = unquote(request.args.get("seperator", "_"))
     user_defined_tag = unquote(request.args.get("userDefinedTag", ""))
@@ -332,8 +433,7 @@ def export_papers():
     names = []
     for paper in papers:
         title = "NA"
-        data = database.get_paper_data(paper.get("paper_id"))
-        metadata = data.get("metadata", {})
+        data = database.get_paper_data(paper.get("paper_id"), fields=["doi", "date", "authors", "title", "journal"])
         name = ""
         for field in selected_fields:
             if field == 'User Defined Tag':
@@ -344,29 +444,29 @@ def export_papers():
                 else:
                     name += "NA" + sep
             elif field == 'DOI':
-                if "DOI" in metadata:
-                    name += metadata["DOI"] + sep
+                if data["doi"]:
+                    name += data["doi"] + sep
                 else:
                     name += "NA" + sep
             elif field == 'Date of Publication':
-                if "created" in metadata:
-                    name += metadata["created"]["date-time"][:10] + sep
+                if data["date"]:
+                    name += data["date"] + sep
                 else:
                     name += "NA" + sep
             elif field == 'First Author':
-                if "author" in metadata:
-                    name += metadata["author"][0]["given"] + "-" + metadata["author"][0]["family"] + sep
+                if data["authors"]:
+                    name += data["authors"][0]["given"] + "-" + data["authors"][0]["family"] + sep
                 else:
                     name += "NA" + sep
             elif field == 'Title':
-                if "title" in metadata:
+                if data["title"]:
                     name += inj + sep
-                    title = metadata["title"][0]
+                    title = data["title"]
                 else:
                     name += "NA" + sep
             elif field == 'Journal':
-                if "container-title" in metadata:
-                    name += metadata["container-title"][0] + sep
+                if data["journal"]:
+                    name += data["journal"] + sep
                 else:
                     name += "NA" + sep
         name = name[:-1]
@@ -409,48 +509,33 @@ def export_papers():
 
         names.append(name)
 
-        shutil.copyfile(database.get_paper_pdf(paper.get("paper_id")), os.path.join(temp_path, name))
-    source = temp_path
-    zip_name = "scienceai_paper_export_"+datetime.now().strftime('%Y-%m-%d_%H-%M-%S')+".zip"
-    destination = os.path.join(path_to_app, "io", zip_name)
-    base = os.path.basename(destination)
-    name = base.split('.')[0]
-    format = base.split('.')[1]
-    archive_from = os.path.dirname(source)
-    archive_to = os.path.basename(source.strip(os.sep))
-    shutil.make_archive(name, format, archive_from, archive_to)
-    shutil.move('%s.%s' % (name, format), destination)
-    shutil.rmtree(temp_dir)
-
-    dir_path = os.path.dirname(destination)
-    path = os.path.basename(destination)
-
-    @after_this_request
-    def remove_file(response):
-        if not sys.platform.startswith("win"):
-            os.remove(destination)
-        return response
-    return send_from_directory(directory=dir_path, path=path, as_attachment=True)
+        entries.append((os.path.join(export_name, name), database.get_paper_pdf(paper.get("paper_id"))))
+    return zip_response(entries, export_name+".zip")
 
 
 @app.route('/save')
 def save():
     from flask import redirect
-    if not database:
+    open_project = current_project()
+    if not open_project:
         return script_to_return_to_menu
-    database.save_database()
+    database = open_project.database
+    # the backend writes checkpoints, if it is busy with a message it saves once that is done
+    open_project.backend.save(timeout=10)
     return redirect('/app')
 
 
 @app.route('/save_project')
 def save_project():
     from flask import render_template
-    if not database:
+    open_project = current_project()
+    if not open_project:
         return script_to_return_to_menu
+    database = open_project.database
     last_save = database.get_last_save()
     if last_save:
         update_time = database.get_update_time().replace(" ", "_").replace(":", "_")
-        ready = last_save.find(update_time) > -1 or last_save == original_save
+        ready = last_save.find(update_time) > -1 or last_save == open_project.original_save
     else:
         ready = False
     messages = database.get_database_chat()
@@ -468,40 +553,23 @@ def save_project():
 
 @app.route('/download_save')
 def download_save():
-    from flask import send_from_directory
-    if not database:
+    open_project = current_project()
+    if not open_project:
         return script_to_return_to_menu
+    database = open_project.database
     save_path = database.get_last_save(path=True)
-    temp_dir = tempfile.mktemp()
     project = os.path.basename(database.project_path)
-    source = os.path.join(temp_dir, project)
-    shutil.copytree(save_path, source)
     zip_name = project.replace(" ", "_")+"_scienceai_save_"+datetime.now().strftime('%Y-%m-%d_%H-%M-%S')+".zip"
-    destination = os.path.join(path_to_app, "io", zip_name)
-    base = os.path.basename(destination)
-    name = base.split('.')[0]
-    format = base.split('.')[1]
-    archive_from = os.path.dirname(source)
-    archive_to = os.path.basename(source.strip(os.sep))
-    shutil.make_archive(name, format, archive_from, archive_to)
-    shutil.move('%s.%s' % (name, format), destination)
-
-    dir_path = os.path.dirname(destination)
-    path = os.path.basename(destination)
-
-    @after_this_request
-    def remove_file(response):
-        if not sys.platform.startswith("win"):
-            os.remove(destination)
-        return response
-    return send_from_directory(directory=dir_path, path=path, as_attachment=True)
+    return zip_response(folder_entries(save_path, project), zip_name)
 
 
 @app.route('/download_analysis')
 def download_analysis():
     from flask import send_from_directory
-    if not database:
+    open_project = current_project()
+    if not open_project:
         return script_to_return_to_menu
+    database = open_project.database
     analysis_path = database.combine_analyst_tool_trackers()
     project = os.path.basename(database.project_path)
     destination = os.path.join(path_to_app, "io", project.replace(" ", "_")+"_scienceai_analysis_"+datetime.now().strftime('%Y-%m-%d_%H-%M-%S')+".csv")
@@ -520,9 +588,6 @@ def download_analysis():
 @app.route('/load_checkpoint', methods=['POST'])
 def load_save():
     from flask import request, redirect
-    if database:
-        close_project()
-        return script_to_return_to_menu
     save_file = request.files["checkpoint"]
     temp_dir = tempfile.mktemp()
     os.makedirs(temp_dir, exist_ok=True)
@@ -541,6 +606,9 @@ def load_save():
     if not os.path.exists(projects_folder):
         os.makedirs(projects_folder)
     project_path = os.path.join(projects_folder, project)
+    if project_key(project) in open_projects:
+        shutil.rmtree(temp_dir)
+        return redirect('/menu?error=Project%20is%20open,%20close%20it%20first')
     if os.path.exists(project_path):
         if request.form.get("overwrite"):
             shutil.rmtree(project_path)
@@ -550,16 +618,16 @@ def load_save():
     shutil.rmtree(temp_dir)
     result = load_project(project)
     if result:
-        return redirect('/app')
+        return open_app(project)
     return redirect('/menu?error=Failed%20to%20load%20project')
 
 
 @app.route('/delete_project', methods=['POST'])
 def delete_project():
     from flask import redirect, request
-    if database:
-        return redirect('/app')
     project = request.form["project"]
+    if project_key(project) in open_projects:
+        return redirect('/menu?error=Project%20is%20open,%20close%20it%20first')
     project_path = os.path.join(db_folder, "scienceai_db")
     checkpoints = []
     for dir in os.listdir(project_path):
@@ -567,17 +635,98 @@ def delete_project():
             checkpoints.append(os.path.join(project_path, dir))
     for checkpoint in checkpoints:
         shutil.rmtree(checkpoint)
+    if os.path.exists(os.path.join(project_path, CHECKPOINT_STORE, project)):
+        shutil.rmtree(os.path.join(project_path, CHECKPOINT_STORE, project))
     shutil.rmtree(os.path.join(project_path, project))
     return redirect('/menu')
 
 
-atexit.register(close)
+atexit.register(close_all)
+
+
+GZIP_MIN_BYTES = 1024
+GZIP_MIMETYPES = ["text/html", "text/css", "text/plain", "text/csv", "text/javascript", "application/javascript",
+                  "application/json"]
+
+
+@app.after_request
+def gzip_response(response):
+    from flask import request
+    # files and streams are sent as they are, only rendered pages and data responses are compressed
+    if response.direct_passthrough or response.is_streamed or response.status_code != 200 or \
+            "Content-Encoding" in response.headers or response.mimetype not in GZIP_MIMETYPES or \
+            "gzip" not in request.headers.get("Accept-Encoding", "").lower():
+        return response
+    data = response.get_data()
+    if len(data) < GZIP_MIN_BYTES:
+        return response
+    response.set_data(gzip.compress(data, compresslevel=6))
+    response.headers["Content-Encoding"] = "gzip"
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+def run_gunicorn(host, port, threads):
+    from gunicorn.app.base import BaseApplication
+
+    class ScienceAIApplication(BaseApplication):
+        def load_config(self):
+            # gthread workers keep each websocket on its own thread without blocking other requests, and there
+            # is only one worker because the open_projects registry lives in its memory
+            self.cfg.set("bind", f"{host}:{port}")
+            self.cfg.set("workers", 1)
+            self.cfg.set("worker_class", "gthread")
+            self.cfg.set("threads", threads)
+
+        def load(self):
+            return app
+
+    ScienceAIApplication().run()
+
+
+def serve(host="127.0.0.1", port=4242, threads=32, server="auto"):
+    """
+    Runs the app on a production server. gunicorn with a threaded worker is used when it is installed, otherwise
+    the threaded werkzeug server. The open projects and their backends are held by the serving process, so a
+    second worker process would not see them and the app is served from one process; raise threads to serve
+    more users.
+    """
+    if server == "auto":
+        try:
+            import gunicorn
+            server = "gunicorn" if not sys.platform.startswith("win") else "werkzeug"
+        except ImportError:
+            server = "werkzeug"
+    print(f"ScienceAI is serving on http://{host}:{port} with {server}")
+    if server == "gunicorn":
+        run_gunicorn(host, port, threads)
+    else:
+        app.run(host=host, port=port, debug=False, threaded=True)
 
 
 def main():
+    import argparse
     import logging
+    parser = argparse.ArgumentParser(prog="scienceai", description="An AI powered scientific literature search engine")
+    parser.add_argument("--storage-engine", choices=STORAGE_ENGINES,
+                        help="storage for projects without a SQLite database yet, sqlite migrates a project when "
+                             "it is opened")
+    commands = parser.add_subparsers(dest="command")
+    serve_parser = commands.add_parser("serve", help="run ScienceAI on a production server for several users")
+    serve_parser.add_argument("--host", default="127.0.0.1", help="address to bind, 0.0.0.0 for every interface")
+    serve_parser.add_argument("--port", type=int, default=4242)
+    serve_parser.add_argument("--threads", type=int, default=32,
+                              help="request threads, every open websocket holds one")
+    serve_parser.add_argument("--server", choices=["auto", "gunicorn", "werkzeug"], default="auto")
+    args = parser.parse_args()
+    if args.storage_engine:
+        # the backend processes read the choice from the environment they inherit
+        os.environ[STORAGE_ENGINE_VARIABLE] = args.storage_engine
     log = logging.getLogger('werkzeug')
     log.setLevel(logging.ERROR)
+    if args.command == "serve":
+        serve(host=args.host, port=args.port, threads=args.threads, server=args.server)
+        return
     # print a clickable link to the user to open the app by navigating to the link
     print("ScienceAI is running. Please open the following link in your browser to access the application:")
     if sys.platform.startswith("win"):
@@ -1,16 +1,34 @@
 from .llm import client, use_tools
 from .database_manager import DatabaseManager
-from .data_extractor import generate_schema, extract_data, schema_to_tool
+from .data_extractor import generate_schema, extract_data, schema_to_tool, tool_hash, tool_fields, subset_tool, \
+    extraction_key, data_type_names, data_type_fields, EXTRACTION_MODEL, SUCCESS_SUFFIX
+import hashlib
+import json
 import os
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 short_id = {}
 
+# papers extracted at once by a data collection request, the LLM scheduler still bounds the requests in flight
+EXTRACTION_WORKERS = 8
+
 path_to_app = os.path.dirname(os.path.abspath(__file__))
 
 with open(os.path.join(path_to_app, "analyst_base_prompt.txt"), "r") as f:
     analyst_system = f.read()
 
 
+def paper_set_hash(paper_ids):
+    return hashlib.sha256(json.dumps(sorted(paper_ids)).encode("utf-8")).hexdigest()
+
+
+def collection_job_key(analyst_name, collection_name, schema_hash, papers_hash):
+    """ Identifies a data collection by analyst, collection name, schema, and the set of papers it covers """
+    key = json.dumps([analyst_name, collection_name, schema_hash, papers_hash])
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
 def reflect_on_evidence(goal, answer, evidence, retries=3):
     system_message = ("The analyst has answered the following question / goal with evidence. "
                       "You are a thoughtful Researcher, evaluate the evidence and "
@@ -144,10 +162,10 @@ class Analyst:
                 }
             }
         output = {}
-        papers = self.db.get_all_papers_data()
+        papers = self.db.get_all_papers_data(fields=["title"])
         for paper in papers:
             short_id[paper['database']['paper_id'][:10]] = paper['database']['paper_id']
-            output[paper['database']['paper_id'][:10]] = paper['metadata']['title'][0]
+            output[paper['database']['paper_id'][:10]] = paper['title']
         return output
 
     def create_named_paper_list(self, name="", paper_ids=[], return_tool=False):
@@ -179,8 +197,7 @@ class Analyst:
             }
         if self.db.get_all_papers(analyst=self.name, named_list=name):
             raise ValueError("List '" + name + "' already exists.")
-        for paper_id in paper_ids:
-            self.db.add_paper_to_list(short_id[paper_id], self.name, name)
+        self.db.add_papers_to_list([short_id[paper_id] for paper_id in paper_ids], self.name, name)
         return "List named '" + name + "' created with papers: " + str(paper_ids)
 
     def get_named_paper_list(self, name="", return_tool=False):
@@ -202,11 +219,11 @@ class Analyst:
                     "required": ["name"],
                 }
             }
-        papers = self.db.get_all_papers_data(analyst=self.name, named_list=name)
+        papers = self.db.get_all_papers_data(analyst=self.name, named_list=name, fields=["title"])
         output = {}
         for paper in papers:
-            short_id[paper['paper_id'][:10]] = paper['database']['paper_id']
-            output[paper['paper_id'][:10]] = paper['metadata']['title'][0]
+            short_id[paper['database']['paper_id'][:10]] = paper['database']['paper_id']
+            output[paper['database']['paper_id'][:10]] = paper['title']
         return output
 
     def create_data_collection_request(self, collection_name="", collection_goal="",
@@ -240,27 +257,112 @@ class Analyst:
 
         if target_list:
             try:
-                papers = self.db.get_all_papers_data(analyst=self.name, named_list=target_list)
+                papers = self.db.get_all_papers_data(analyst=self.name, named_list=target_list,
+                                                     fields=["title", "summary"])
             except ValueError:
                 raise ValueError("List not found.")
         else:
-            papers = self.db.get_all_papers_data()
+            papers = self.db.get_all_papers_data(fields=["title", "summary"])
 
-        summaries = ""
-        for paper in papers:
-            summaries += paper["metadata"]["title"][0] + "\n\nSummary: " + paper["summary"] + "\n\n\n"
-        schema = generate_schema(summaries, goal=collection_name+" - "+collection_goal)
+        paper_ids = [paper["database"]["paper_id"] for paper in papers]
+        papers_hash = paper_set_hash(paper_ids)
+        # a collection that was interrupted keeps its schema, so asking for it again resumes it
+        job = None
+        for running_job in self.db.get_collection_jobs(self.name, status="running"):
+            if running_job["collection_name"] == collection_name and \
+                    running_job["collection_goal"] == collection_goal and \
+                    running_job["papers_hash"] == papers_hash:
+                job = running_job
+        if job:
+            schema = job["schema"]
+        else:
+            summaries = ""
+            for paper in papers:
+                summaries += paper["title"] + "\n\nSummary: " + paper["summary"] + "\n\n\n"
+            schema = generate_schema(summaries, goal=collection_name+" - "+collection_goal)
         tool = schema_to_tool(schema)
+        key = collection_job_key(self.name, collection_name, tool_hash(tool), papers_hash)
+        if job is None or job["key"] != key:
+            job = {"key": key, "collection_name": collection_name, "collection_goal": collection_goal,
+                   "target_list": target_list, "papers_hash": papers_hash, "schema": schema, "status": "running",
+                   "tracker": self.db.add_analyst_tool_tracker(self.name, collection_name)}
+            self.db.save_collection_job(self.name, job)
+        tracker = job["tracker"]
 
-        results = {}
-        tracker = self.db.add_analyst_tool_tracker(self.name, collection_name)
-        for paper in papers:
-            result = extract_data(tool, paper["cleaned_text"])
-            self.db.update_analyst_tool_tracker(tracker, paper["database"]["paper_id"], result)
-            short_id[paper["database"]["paper_id"][:10]] = paper["database"]["paper_id"]
-            results[paper["database"]["paper_id"][:10]] = result
+        done = self.db.get_analyst_tool_tracker(tracker) or {}
+        results = {paper_id[:10]: done[paper_id] for paper_id in paper_ids if paper_id in done}
+        for paper_id in paper_ids:
+            short_id[paper_id[:10]] = paper_id
+        if results:
+            print(f"Resuming data collection {collection_name}, {len(results)} of {len(paper_ids)} papers done")
+        with ThreadPoolExecutor(max_workers=EXTRACTION_WORKERS) as executor:
+            futures = {executor.submit(self.extract_paper_data, tool, paper_id): paper_id
+                       for paper_id in paper_ids if paper_id not in done}
+            for future in as_completed(futures):
+                paper_id = futures[future]
+                error = future.exception()
+                if error:
+                    print(f"Failed to extract data from paper {paper_id}")
+                    traceback.print_exception(error)
+                    results[paper_id[:10]] = f"Data extraction failed: {error}"
+                    continue
+                result = future.result()
+                self.db.update_analyst_tool_tracker(tracker, paper_id, result)
+                results[paper_id[:10]] = result
         self.db.convert_analyst_tool_tracker(self.name, collection_name)
-        return results
+        self.db.save_collection_job(self.name, {**job, "status": "complete"})
+        return {paper_id[:10]: results[paper_id[:10]] for paper_id in paper_ids}
+
+    def resume_collections(self):
+        """
+        Finishes the data collections that were running when the backend stopped, recording each as a call to
+        create_data_collection_request in the analyst's context so the analyst continues from their results.
+        """
+        for job in self.db.get_collection_jobs(self.name, status="running"):
+            print(f"Resuming data collection {job['collection_name']} for {self.name}")
+            arguments = {"collection_name": job["collection_name"], "collection_goal": job["collection_goal"]}
+            if job["target_list"]:
+                arguments["target_list"] = job["target_list"]
+            tool_call = {"function": {"name": "create_data_collection_request", "arguments": json.dumps(arguments)},
+                         "id": "resume_" + job["key"][:24], "type": "function"}
+            history = use_tools({"content": None, "tool_calls": [tool_call]}, {"tools": self.tools},
+                                function_dict=self.tool_callables)
+            for call in history:
+                self.db.add_analyst_context(self.name, call)
+
+    def extract_paper_data(self, tool, paper_id, model=EXTRACTION_MODEL):
+        """
+        Extracts the tool's fields from a paper through the project's extraction cache. A cached extraction
+        with the same tool and model is reused as is; one whose fields are all part of this tool, with the
+        same definitions, is reused for the data types it holds a result for and only the rest are extracted,
+        including the ones it failed to extract.
+        """
+        key = extraction_key(tool, model)
+        cached = self.db.get_extractions(paper_id)
+        if key in cached:
+            return cached[key]["result"]
+        fields = tool_fields(tool)
+        base = None
+        for entry in cached.values():
+            if entry["model"] != model or any(fields.get(field) != spec for field, spec in entry["fields"].items()):
+                continue
+            if base is None or len(entry["result"]) > len(base["result"]):
+                base = entry
+        result = dict(base["result"]) if base else {}
+        missing = [name for name in data_type_names(fields)
+                   if not any(field in result for field in data_type_fields(name, fields))]
+        if missing:
+            cleaned_text = self.db.get_paper_data(paper_id, fields=["cleaned_text"])["cleaned_text"]
+            request_tool = tool if not result else \
+                subset_tool(tool, [field for name in missing for field in data_type_fields(name, fields)] +
+                            [name + SUCCESS_SUFFIX for name in missing])
+            extracted = extract_data(request_tool, cleaned_text, model=model)
+            if extracted is None:
+                # what the smaller extraction found still holds, but this tool's entry is left for a later attempt
+                return result or None
+            result.update(extracted)
+        self.db.store_extraction(paper_id, key, {"model": model, "fields": fields, "result": result})
+        return result
 
     def complete_goal_by_answering_question_with_evidence(self, answer="", evidence="", return_tool=False):
         if return_tool:
@@ -345,14 +447,16 @@ class Analyst:
             ]
             for message in messages:
                 self.db.add_analyst_context(self.name, message)
+        # the context is read once; every later message is appended to the log and, unless hidden as
+        # get_analyst_context would filter it, to the messages sent to the model
         while not self.answer:
-            messages = self.db.get_analyst_context(self.name)
             arguments = {"messages": messages, "model": "gpt-4o", "tools": self.tools, "temperature": 0.2}
             chat_response = client.chat.completions.create(**arguments)
             new_history = use_tools(chat_response, arguments, function_dict=self.tool_callables)
             for call in new_history:
                 self.db.add_analyst_context(self.name, call)
-                messages.append(call)
+                if not call.get("hidden", False):
+                    messages.append(call)
             if self.answer_attempts > self.attempts and not self.answer:
                 self.answer = ("The analyst has not been able to answer the question in the allotted attempts. "
                                "Refine the goal and make sure it is specific and longer to help the next analyst "
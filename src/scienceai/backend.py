@@ -1,10 +1,48 @@
+import multiprocessing
+import queue
+import threading
+import time
 import traceback
 
 
-def run_backend(folder, project_path, storage_path, message_queue, stop_event):
+# commands put on the backend's command queue
+MESSAGE = "message"
+SAVE = "save"
+STOP = "stop"
+# events the backend puts on its event queue
+STARTED = "started"
+READY = "ready"
+PROGRESS = "progress"
+MESSAGE_DONE = "message_done"
+SAVED = "saved"
+ERROR = "error"
+STOPPED = "stopped"
+
+# opening a project can migrate or index it, but a backend that never reports back must not hang the web app
+BACKEND_START_TIMEOUT = 300
+
+
+def send_event(event_queue, event, **data):
+    if event_queue is not None:
+        event_queue.put({"event": event, **data})
+
+
+def run_backend(folder, project_path, storage_path, message_queue, stop_event, event_queue=None, rate_budget=None,
+                openai_key=None):
+    """
+    Opens the project, ingests its papers, and answers chat messages from message_queue until it gets a stop
+    command. Commands are {"command": MESSAGE, "message": {...}}, {"command": SAVE}, and {"command": STOP}; a
+    bare message dict or {"TERMINATE": True} from older callers is also understood. Progress is reported on
+    event_queue. A rate_budget proxy makes LLM requests share limits with the backends of other projects.
+    openai_key is the key the starting process validated, a spawned backend does not read or prompt for one.
+    """
     try:
-        from .llm import update_stop_event
+        from .llm import update_stop_event, use_rate_budget, use_api_key
+        if openai_key is not None:
+            use_api_key(openai_key)
         update_stop_event(stop_event)
+        if rate_budget is not None:
+            use_rate_budget(rate_budget)
         from .process_paper import process_paper
         from .database_manager import DatabaseManager
         from .principle_investigator import PrincipalInvestigator
@@ -13,30 +51,135 @@ def run_backend(folder, project_path, storage_path, message_queue, stop_event):
         import time
         start = time.time()
         dm = DatabaseManager(folder, process_paper, project_path, storage_path=storage_path)
-        pi = PrincipalInvestigator(dm)
+        send_event(event_queue, STARTED)
+
+        def report_progress(completed, total, paper_id, error):
+            send_event(event_queue, PROGRESS, completed=completed, total=total, paper_id=paper_id,
+                       error=str(error) if error else None)
+
+        pi = PrincipalInvestigator(dm, progress_callback=report_progress)
         if time.time() - start > 5*60:
             dm.save_database()
             if sys.platform == "darwin":
                 subprocess.Popen(["say", "ScienceAI is ready"])
+        send_event(event_queue, READY)
         while True:
-            if message_queue.empty():
-                time.sleep(1)
-            else:
-                message = message_queue.get()
-                if message.get("TERMINATE"):
-                    print("Terminating backend")
-                    break
-                elif stop_event.is_set():
+            try:
+                command = message_queue.get(timeout=1)
+            except queue.Empty:
+                if stop_event.is_set():
                     print("Stop event set. Terminating backend")
                     break
-                start = time.time()
-                pi.process_message(**message)
-                end = time.time()
-                if end - start > 10 and sys.platform == "darwin":
-                    subprocess.Popen(["say", "New message from ScienceAI"])
+                continue
+            if command.get("TERMINATE") or command.get("command") == STOP:
+                print("Terminating backend")
+                break
+            elif stop_event.is_set():
+                print("Stop event set. Terminating backend")
+                break
+            elif command.get("command") == SAVE:
                 dm.save_database()
+                send_event(event_queue, SAVED)
+                continue
+            message = command["message"] if command.get("command") == MESSAGE else command
+            start = time.time()
+            pi.process_message(**message)
+            end = time.time()
+            if end - start > 10 and sys.platform == "darwin":
+                subprocess.Popen(["say", "New message from ScienceAI"])
+            dm.save_database()
+            send_event(event_queue, MESSAGE_DONE)
+        send_event(event_queue, STOPPED)
     except Exception as e:
         print("Backend error")
         traceback.print_exc()
+        send_event(event_queue, ERROR, error=str(e), traceback=traceback.format_exc())
         raise e
 
+
+class BackendProcess:
+    """
+    Runs run_backend in its own process, so paper rendering and database writes do not compete with the web
+    app for the GIL. Messages and the stop command go out on a command queue; a listener thread keeps
+    status, progress, and error up to date from the backend's event queue.
+    """
+    def __init__(self, folder, project_path, storage_path, rate_budget=None, openai_key=None):
+        # spawn rather than fork, the web app has threads running that a forked child would inherit locked
+        context = multiprocessing.get_context("spawn")
+        self.commands = context.Queue()
+        self.events = context.Queue()
+        self.stop_event = context.Event()
+        # not a daemon, the backend starts its own process pool for rendering pages
+        self.process = context.Process(target=run_backend, args=(folder, project_path, storage_path, self.commands,
+                                                                  self.stop_event, self.events, rate_budget,
+                                                                  openai_key))
+        self.status = "starting"
+        self.progress = None
+        self.error = None
+        self._started = threading.Event()
+        self._saved = threading.Event()
+        self._listener = threading.Thread(target=self._listen, daemon=True)
+
+    def start(self, timeout=BACKEND_START_TIMEOUT):
+        """
+        Starts the backend and waits until it has opened the project database. Returns False if it failed, died,
+        or did not open the database within timeout seconds.
+        """
+        self.process.start()
+        self._listener.start()
+        deadline = time.monotonic() + timeout
+        while not self._started.wait(1):
+            if not self.process.is_alive() and self.events.empty():
+                break
+            if time.monotonic() > deadline:
+                self.error = f"Backend did not open the project within {timeout} seconds"
+                break
+        return self.status not in ["starting", ERROR, STOPPED]
+
+    def _listen(self):
+        while True:
+            try:
+                event = self.events.get(timeout=1)
+            except queue.Empty:
+                if not self.process.is_alive():
+                    if self.status != ERROR:
+                        self.status = STOPPED
+                    self._started.set()
+                    return
+                continue
+            if event["event"] == PROGRESS:
+                self.progress = event
+            elif event["event"] == SAVED:
+                self._saved.set()
+            elif event["event"] == ERROR:
+                self.error = event["traceback"]
+            if event["event"] in [STARTED, READY, ERROR, STOPPED]:
+                self.status = event["event"]
+            if event["event"] in [STARTED, ERROR, STOPPED]:
+                self._started.set()
+            if event["event"] in [ERROR, STOPPED]:
+                return
+
+    def send_message(self, message):
+        self.commands.put({"command": MESSAGE, "message": message})
+
+    def save(self, timeout=None):
+        """
+        Asks the backend to checkpoint the project, so only one process ever writes checkpoints. The backend
+        handles it after the message it is working on; returns whether it finished within timeout.
+        """
+        self._saved.clear()
+        self.commands.put({"command": SAVE})
+        return self._saved.wait(timeout)
+
+    def is_alive(self):
+        return self.process.is_alive()
+
+    def stop(self, timeout=30):
+        self.commands.put({"command": STOP})
+        self.stop_event.set()
+        self.process.join(timeout)
+        if self.process.is_alive():
+            print("Backend did not stop in time, terminating it")
+            self.process.terminate()
+            self.process.join()
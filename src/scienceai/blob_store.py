@@ -0,0 +1,47 @@
+import base64
+import hashlib
+import os
+import threading
+
+
+class BlobStore:
+    """
+    Content addressed store for binary files such as rendered pages. Blobs are written once under the sha256
+    of their content, so storing the same page twice costs nothing, and references stay valid across copies
+    of the project folder.
+    """
+    def __init__(self, root):
+        self.root = root
+        if not os.path.exists(self.root):
+            os.makedirs(self.root)
+
+    def path(self, ref):
+        return os.path.join(self.root, ref[:2], ref)
+
+    def exists(self, ref):
+        return os.path.exists(self.path(ref))
+
+    def put(self, data, extension="bin"):
+        ref = hashlib.sha256(data).hexdigest() + "." + extension
+        target = self.path(ref)
+        if not os.path.exists(target):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            # writers of the same blob each fill their own temp file, whichever is renamed last wins
+            temp_path = f"{target}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, "wb") as file:
+                file.write(data)
+            os.replace(temp_path, target)
+        return ref
+
+    def get(self, ref):
+        with open(self.path(ref), "rb") as file:
+            return file.read()
+
+    def put_data_url(self, data_url):
+        header, encoded = data_url.split(",", 1)
+        extension = header[len("data:"):].split(";")[0].split("/")[-1] or "bin"
+        return self.put(base64.b64decode(encoded), extension=extension)
+
+    def get_data_url(self, ref):
+        extension = ref.split(".")[1]
+        return "data:image/" + extension + ";base64," + base64.b64encode(self.get(ref)).decode("utf-8")
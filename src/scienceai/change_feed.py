@@ -0,0 +1,109 @@
+import os
+import threading
+import time
+
+
+COLLECTIONS = ["chat", "papers", "analysts"]
+POLL_INTERVAL = 1.0
+
+
+class ChangeFeed:
+    """
+    Tells readers which collections of a project changed. Writers in this process wake waiting readers
+    through a condition variable, so an idle reader costs nothing and an update reaches it immediately.
+    Every change also replaces a small marker file per collection holding the update time; readers that
+    share the project with another process set watch_files and check those files once per POLL_INTERVAL.
+    Use ChangeFeed.for_path so every DatabaseManager of a project in this process shares one feed.
+    """
+    _feeds = {}
+    _feeds_lock = threading.Lock()
+
+    @classmethod
+    def for_path(cls, path):
+        path = os.path.abspath(path)
+        with cls._feeds_lock:
+            if path not in cls._feeds:
+                cls._feeds[path] = cls(path)
+            return cls._feeds[path]
+
+    def __init__(self, path):
+        self.path = path
+        self.watch_files = False
+        self._condition = threading.Condition()
+        self._versions = {collection: 0 for collection in COLLECTIONS}
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        self._stamps = {collection: self._stamp(collection) for collection in COLLECTIONS}
+
+    def _marker_path(self, collection):
+        return os.path.join(self.path, collection)
+
+    def _stamp(self, collection):
+        try:
+            stat = os.stat(self._marker_path(collection))
+        except FileNotFoundError:
+            return None
+        # markers are replaced rather than rewritten, so the inode changes even within one mtime tick
+        return stat.st_ino, stat.st_mtime_ns
+
+    def _poll_files(self):
+        changed = False
+        for collection in COLLECTIONS:
+            stamp = self._stamp(collection)
+            if stamp != self._stamps[collection]:
+                self._stamps[collection] = stamp
+                self._versions[collection] += 1
+                changed = True
+        return changed
+
+    def versions(self):
+        with self._condition:
+            if self.watch_files:
+                self._poll_files()
+            return dict(self._versions)
+
+    def notify(self, collections, update_time):
+        with self._condition:
+            # the project folder may have been deleted and created again while this process kept the feed
+            os.makedirs(self.path, exist_ok=True)
+            for collection in collections:
+                marker = self._marker_path(collection)
+                temp_path = marker + f".{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(temp_path, "w") as file:
+                    file.write(update_time)
+                os.replace(temp_path, marker)
+                self._stamps[collection] = self._stamp(collection)
+                self._versions[collection] += 1
+            self._condition.notify_all()
+
+    def wait(self, since, collections=None, timeout=None):
+        """
+        Blocks until one of the collections has a newer version than in since, a dict returned by versions()
+        or a previous wait, or until timeout seconds pass. Returns the current versions.
+        """
+        collections = collections or COLLECTIONS
+        deadline = None if timeout is None else time.time() + timeout
+        with self._condition:
+            while True:
+                if self.watch_files:
+                    self._poll_files()
+                if any(self._versions[collection] != since.get(collection) for collection in collections):
+                    return dict(self._versions)
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return dict(self._versions)
+                if self.watch_files:
+                    remaining = POLL_INTERVAL if remaining is None else min(remaining, POLL_INTERVAL)
+                self._condition.wait(remaining)
+
+    def last_update_time(self):
+        """ Returns the latest update time written by any process, or None if nothing changed yet """
+        update_times = []
+        for collection in COLLECTIONS:
+            try:
+                with open(self._marker_path(collection), "r") as file:
+                    update_times.append(file.read())
+            except FileNotFoundError:
+                continue
+        update_times = [update_time for update_time in update_times if len(update_time) > 11]
+        return max(update_times) if update_times else None
@@ -0,0 +1,180 @@
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+from contextlib import contextmanager
+
+if sys.platform.startswith("win"):
+    import msvcrt
+else:
+    import fcntl
+
+
+CHECKPOINT_STORE = "_checkpoint_store"
+HASH_CHUNK_BYTES = 1024 * 1024
+
+
+@contextmanager
+def file_lock(path):
+    """ Holds an exclusive lock on the file at path, against other threads and processes alike """
+    with open(path, "a+b") as file:
+        if sys.platform.startswith("win"):
+            while True:
+                try:
+                    file.seek(0)
+                    msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+                    break
+                except OSError:
+                    time.sleep(0.1)
+            try:
+                yield
+            finally:
+                file.seek(0)
+                msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            # flock locks belong to the open file, so threads of one process exclude each other too
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_BYTES), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class CheckpointStore:
+    """
+    Content addressed store behind project checkpoints. A checkpoint is still a plain copy of the project
+    folder, but every file in it is a hardlink to an object named by the sha256 of its content, so a file
+    that did not change since the last checkpoint costs a link instead of a copy. Each checkpoint has a
+    manifest of the size, mtime, and hash of every file, which lets the next checkpoint skip hashing files
+    whose size and mtime are unchanged. An object is live while a manifest refers to it; snapshots and
+    deletes must hold lock(), which the backend and the web app both take, so no sweep runs while linking.
+    """
+    def __init__(self, root):
+        self.root = root
+        self.objects_path = os.path.join(root, "objects")
+        self.manifests_path = os.path.join(root, "manifests")
+        self.staging_path = os.path.join(root, "staging")
+        for path in [self.objects_path, self.manifests_path, self.staging_path]:
+            if not os.path.exists(path):
+                os.makedirs(path)
+
+    def lock(self):
+        return file_lock(os.path.join(self.root, "lock"))
+
+    def object_path(self, digest):
+        return os.path.join(self.objects_path, digest[:2], digest)
+
+    def manifest_path(self, checkpoint_name):
+        return os.path.join(self.manifests_path, checkpoint_name + ".json")
+
+    def read_manifest(self, checkpoint_name):
+        if not checkpoint_name or not os.path.exists(self.manifest_path(checkpoint_name)):
+            return {"files": {}}
+        with open(self.manifest_path(checkpoint_name), "r") as file:
+            return json.load(file)
+
+    def _store(self, path):
+        """ Adds a file to the store, only copying it if no object has the same content, returns its hash """
+        digest = file_sha256(path)
+        if os.path.exists(self.object_path(digest)):
+            return digest
+        temp_path = os.path.join(self.staging_path, digest + ".tmp")
+        copied = hashlib.sha256()
+        with open(path, "rb") as source, open(temp_path, "wb") as target:
+            for chunk in iter(lambda: source.read(HASH_CHUNK_BYTES), b""):
+                copied.update(chunk)
+                target.write(chunk)
+        # the file may have changed since it was hashed, the object is named after what was copied
+        digest = copied.hexdigest()
+        os.makedirs(os.path.dirname(self.object_path(digest)), exist_ok=True)
+        os.replace(temp_path, self.object_path(digest))
+        return digest
+
+    def _link(self, digest, destination):
+        try:
+            os.link(self.object_path(digest), destination)
+        except OSError:
+            shutil.copy2(self.object_path(digest), destination)
+
+    def snapshot(self, source, destination, previous=None):
+        """
+        Writes a checkpoint of the source folder to destination, reusing the hashes recorded for the previous
+        checkpoint. The checkpoint is assembled in the staging folder and moved into place when complete.
+        """
+        checkpoint_name = os.path.basename(destination)
+        known_files = self.read_manifest(previous)["files"]
+        staging = os.path.join(self.staging_path, checkpoint_name)
+        if os.path.exists(staging):
+            shutil.rmtree(staging)
+        files = {}
+        stored = 0
+        for root, dirs, filenames in os.walk(source):
+            relative_root = os.path.relpath(root, source)
+            os.makedirs(os.path.join(staging, relative_root), exist_ok=True)
+            for filename in filenames:
+                relative = os.path.normpath(os.path.join(relative_root, filename))
+                path = os.path.join(root, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                known = known_files.get(relative)
+                if known and known["size"] == stat.st_size and known["mtime_ns"] == stat.st_mtime_ns and \
+                        os.path.exists(self.object_path(known["sha256"])):
+                    digest = known["sha256"]
+                else:
+                    try:
+                        digest = self._store(path)
+                    except FileNotFoundError:
+                        continue
+                    stored += 1
+                self._link(digest, os.path.join(staging, relative))
+                files[relative] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": digest}
+        with open(self.manifest_path(checkpoint_name), "w") as file:
+            json.dump({"files": files}, file)
+        replaced = os.path.exists(destination)
+        if replaced:
+            shutil.rmtree(destination)
+        os.replace(staging, destination)
+        if replaced:
+            self.collect_garbage()
+        print(f"Checkpoint {checkpoint_name}: {stored} of {len(files)} files stored, the rest linked")
+        return destination
+
+    def delete(self, checkpoint_path):
+        """ Removes a checkpoint folder and every object no other checkpoint links to """
+        checkpoint_name = os.path.basename(checkpoint_path)
+        shutil.rmtree(checkpoint_path)
+        if os.path.exists(self.manifest_path(checkpoint_name)):
+            os.remove(self.manifest_path(checkpoint_name))
+        self.collect_garbage()
+
+    def live_objects(self):
+        """ Returns the hashes of every file recorded in a checkpoint manifest """
+        live = set()
+        for filename in os.listdir(self.manifests_path):
+            if filename.endswith(".json"):
+                manifest = self.read_manifest(filename[:-len(".json")])
+                live.update(entry["sha256"] for entry in manifest["files"].values())
+        return live
+
+    def collect_garbage(self):
+        """ Removes the objects no manifest refers to, link counts are not used as links may have been copies """
+        live = self.live_objects()
+        removed = 0
+        for root, dirs, filenames in os.walk(self.objects_path):
+            for filename in filenames:
+                if filename not in live:
+                    os.remove(os.path.join(root, filename))
+                    removed += 1
+        return removed
@@ -1,8 +1,26 @@
+import copy
+import difflib
+import hashlib
 import json
 import os
+import re
 from .llm import client, use_tools
 
 
+EXTRACTION_MODEL = "gpt-4o"
+# "quotes" has every extracted data type cite the paper and checks the quotes locally, "reflection" has the model
+# review the whole extraction against the whole paper
+EXTRACTION_VERIFICATION = "quotes"
+QUOTE_MATCH_THRESHOLD = 0.85
+# a shorter quote such as "a" or "42" is found in almost any paper and verifies nothing
+MIN_QUOTE_WORDS = 4
+# share of the extracted value's words and numbers that must appear in or around the quoted passage
+VALUE_MATCH_THRESHOLD = 0.5
+QUOTE_CONTEXT_CHARS = 300
+EVIDENCE_SUFFIX = "_evidence_quote"
+SUCCESS_SUFFIX = "_successfully_extracted"
+
+
 data_types = None
 data_types_file = "data_types.json"
 
@@ -23,6 +41,11 @@ def load_json_file(filename):
 data_types = load_json_file(data_types_file)
 data_types_docs = load_json_file(data_types_docs_file)
 
+# schema_to_tool names every property of a data type after it: its name alone (array types), or its name joined
+# to one of these keys of the prefix types
+DATA_TYPE_SUFFIXES = sorted({"_" + key for data_type in data_types.values() if data_type["tool"]["mode"] == "prefix"
+                             for key in data_type["tool"] if key != "mode"})
+
 
 def validate_data_type_spec(spec, force_type=None):
     if force_type:
@@ -323,7 +346,8 @@ def schema_to_tool(schema):
                 {"type": "boolean", "description": "Was the data for "+name+" successfully extracted?"}
             required.append(name + "_successfully_extracted")
 
-    required = list(set(required))
+    # sorted so the same schema always gives the same tool, tool_hash relies on it
+    required = sorted(set(required))
 
     tools = [
         {
@@ -342,86 +366,228 @@ def schema_to_tool(schema):
     return tools
 
 
-def reflect_on_data_extraction(extraction, corpus, retries=3):
+def tool_hash(tools):
+    """ Returns a hash of a schema_to_tool output that does not depend on the order of its keys """
+    return hashlib.sha256(json.dumps(tools, sort_keys=True).encode("utf-8")).hexdigest()
 
-        system_message = "You are a careful data analyst. Reflect on the data extraction process."
 
-        user_message = ("Was this data correctly extracted from this research paper? Explain why or why not. "
-                        "\n\nData Extracted:\n\n") + extraction + "\n\nResearch Paper:" + corpus
+def tool_fields(tools):
+    """ Returns the properties a schema_to_tool output asks for """
+    return tools[0]["function"]["parameters"]["properties"]
 
-        messages = [
-            {
-                "role": "system",
-                "content": system_message
-            },
-            {
-                "role": "user",
-                "content": user_message
-            }
-        ]
 
-        arguments = {"messages": messages, "model": "gpt-4o"}
+def subset_tool(tools, fields):
+    """ Returns a copy of a schema_to_tool output that only asks for the given fields """
+    tools = copy.deepcopy(tools)
+    parameters = tools[0]["function"]["parameters"]
+    parameters["properties"] = {field: spec for field, spec in parameters["properties"].items() if field in fields}
+    parameters["required"] = [field for field in parameters["required"] if field in fields]
+    return tools
+
 
-        chat_response = client.chat.completions.create(**arguments)
+def extraction_key(tools, model=EXTRACTION_MODEL):
+    """ Identifies an extraction by the canonical form of its tool and the model that runs it """
+    return hashlib.sha256((tool_hash(tools) + model).encode("utf-8")).hexdigest()
+
+
+def find_incorrect_data_types(extraction, corpus, names, retries=3, model=EXTRACTION_MODEL):
+    """
+    Has the model review the extraction against the corpus, then name which of the extracted data types are
+    wrong, so only those need to be extracted again. Returns the incorrect names, all of them if no review came back.
+    """
+    system_message = "You are a careful data analyst. Reflect on the data extraction process."
+
+    user_message = ("Was each of these data types correctly extracted from this research paper? Explain why or "
+                    "why not for each one.\n\nData Extracted:\n\n") + extraction + "\n\nResearch Paper:" + corpus
+
+    messages = [
+        {
+            "role": "system",
+            "content": system_message
+        },
+        {
+            "role": "user",
+            "content": user_message
+        }
+    ]
+
+    arguments = {"messages": messages, "model": model}
+
+    chat_response = client.chat.completions.create(**arguments)
+
+    messages.append({"role": "assistant", "content": chat_response.choices[0].message.content})
 
-        messages.append({"role": "assistant", "content": chat_response.choices[0].message.content})
-
-        tools = [
-            {
-                "type": "function",
-                "function": {
-                    "name": "check_extracted_data",
-                    "description": "Logs if the extracted data was 100% perfectly extracted.",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "valid": {"type": "boolean", "description": "Whether the extracted data was "
-                                                                        "100% perfectly extracted. Do not "
-                                                                        "set this to true if there were any "
-                                                                        "errors in the extraction or even"
-                                                                        "minor mistakes."}
-                        }
+    tools = [
+        {
+            "type": "function",
+            "function": {
+                "name": "log_incorrect_data_types",
+                "description": "Logs which data types were not 100% perfectly extracted.",
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "incorrect_data_types": {"type": "array",
+                                                 "description": "The data types with any errors in their "
+                                                                "extraction, even minor mistakes. Empty if "
+                                                                "every data type was perfectly extracted.",
+                                                 "items": {"type": "string", "enum": names}}
                     },
-                    "required": ["valid"]
+                    "required": ["incorrect_data_types"]
                 }
             }
-        ]
+        }
+    ]
 
-        arguments = {"messages": messages, "model": "gpt-4o", "tools": tools,
-                     "tool_choice": {"type": "function", "function": {"name": "check_extracted_data"}}}
+    arguments = {"messages": messages, "model": model, "tools": tools,
+                 "tool_choice": {"type": "function", "function": {"name": "log_incorrect_data_types"}}}
 
-        retry = 0
-        valid_calls = []
-        while valid_calls == [] and retry < retries:
-            if retry > 0:
-                print("Retrying...")
-            chat_response = client.chat.completions.create(**arguments)
-            if chat_response.choices[0].message.tool_calls:
-                valid_calls = use_tools(chat_response, arguments, call_functions=False)
-                if valid_calls:
-                    for call in valid_calls:
-                        if call["name"] == "check_extracted_data":
-                            return call["parameters"]["valid"]
-            retry += 1
-        return False
+    retry = 0
+    valid_calls = []
+    while valid_calls == [] and retry < retries:
+        if retry > 0:
+            print("Retrying...")
+        chat_response = client.chat.completions.create(**arguments)
+        if chat_response.choices[0].message.tool_calls:
+            valid_calls = use_tools(chat_response, arguments, call_functions=False)
+            if valid_calls:
+                for call in valid_calls:
+                    if call["name"] == "log_incorrect_data_types":
+                        return [name for name in call["parameters"].get("incorrect_data_types", []) if name in names]
+        retry += 1
+    return list(names)
+
+
+def data_type_names(properties):
+    """ Returns the names of the data types in a tool's properties or an extraction, one per success flag """
+    return [key[:-len(SUCCESS_SUFFIX)] for key in properties if key.endswith(SUCCESS_SUFFIX)]
+
+
+def data_type_fields(name, data):
+    """
+    Returns the keys of data that hold the named data type's value, its success flag and evidence quote excluded.
+    Keys are matched exactly against the names schema_to_tool gives it, so "age" does not take "age_group_value".
+    """
+    names = {name} | {name + suffix for suffix in DATA_TYPE_SUFFIXES}
+    return [key for key in data if key in names]
+
+
+def add_evidence_fields(tools):
+    """ Returns a copy of a schema_to_tool output that also asks for a supporting quote per data type """
+    tools = copy.deepcopy(tools)
+    parameters = tools[0]["function"]["parameters"]
+    for name in data_type_names(parameters["properties"]):
+        parameters["properties"][name + EVIDENCE_SUFFIX] = {
+            "type": "string",
+            "description": "A passage of at least " + str(MIN_QUOTE_WORDS) + " words copied word for word from the "
+                           "research paper that supports the data extracted for " + name + ". Leave empty if "
+                           "the data was not found."}
+        parameters["required"].append(name + EVIDENCE_SUFFIX)
+    return tools
+
+
+def normalize_text(text):
+    return " ".join(text.lower().split())
+
+
+def find_quote(quote, text, matcher, threshold=QUOTE_MATCH_THRESHOLD):
+    """
+    Finds a quote in normalized text, which the matcher already holds as its second sequence, and returns the
+    (start, end) of the matching passage or None. An exact match is found, otherwise the passage around the
+    longest common block must be at least threshold similar. Quotes under MIN_QUOTE_WORDS words never match.
+    """
+    quote = normalize_text(quote)
+    if len(quote.split()) < MIN_QUOTE_WORDS:
+        return None
+    start = text.find(quote)
+    if start >= 0:
+        return start, start + len(quote)
+    matcher.set_seq1(quote)
+    match = matcher.find_longest_match(0, len(quote), 0, len(text))
+    if match.size == 0:
+        return None
+    start = max(match.b - match.a, 0)
+    passage = text[start:start + len(quote)]
+    if difflib.SequenceMatcher(None, quote, passage, autojunk=False).ratio() >= threshold:
+        return start, start + len(quote)
+    return None
+
+
+def value_tokens(value):
+    """ Returns the normalized words and numbers of an extracted value, booleans and empty values have none """
+    if value is None or isinstance(value, bool):
+        return []
+    if isinstance(value, dict):
+        return [token for item in value.values() for token in value_tokens(item)]
+    if isinstance(value, list):
+        return [token for item in value for token in value_tokens(item)]
+    if isinstance(value, (int, float)):
+        value = f"{value:g}"
+    return re.findall(r"\d+(?:\.\d+)?|\w+", normalize_text(str(value)))
+
+
+def value_near_passage(value, text, span):
+    """ Checks that enough of the value's tokens appear in the passage at span or the text around it """
+    tokens = set(value_tokens(value))
+    if not tokens:
+        return True
+    window = text[max(span[0] - QUOTE_CONTEXT_CHARS, 0):span[1] + QUOTE_CONTEXT_CHARS]
+    found = tokens & set(re.findall(r"\d+(?:\.\d+)?|\w+", window))
+    return len(found) >= VALUE_MATCH_THRESHOLD * len(tokens)
+
+
+def unverified_data_types(data, corpus, threshold=QUOTE_MATCH_THRESHOLD):
+    """
+    Returns the data types of an extraction whose evidence quote can not be found in the corpus, or whose
+    extracted value does not appear in or near the quoted passage
+    """
+    text = normalize_text(corpus)
+    # the text is indexed once and every quote is matched against it
+    matcher = difflib.SequenceMatcher(None, autojunk=False)
+    matcher.set_seq2(text)
+    unverified = []
+    for name in data_type_names(data):
+        if not data[name + SUCCESS_SUFFIX]:
+            continue
+        span = find_quote(data.get(name + EVIDENCE_SUFFIX) or "", text, matcher, threshold)
+        value = {key: data[key] for key in data_type_fields(name, data)}
+        if span is None or not value_near_passage(value, text, span):
+            unverified.append(name)
+    return unverified
+
+
+def rejected_data_types(data, corpus, verification=EXTRACTION_VERIFICATION, model=EXTRACTION_MODEL):
+    """
+    Returns the successfully extracted data types that fail verification. With "quotes" only the data types
+    whose quote is not found in the paper are reviewed by the model, with "reflection" all of them are.
+    """
+    if verification == "quotes":
+        review_names = unverified_data_types(data, corpus)
+        if review_names:
+            print(f"Evidence not found in the paper for {', '.join(review_names)}, reviewing them")
+    else:
+        review_names = [name for name in data_type_names(data) if data[name + SUCCESS_SUFFIX]]
+    if not review_names:
+        return []
+    review = {key: data[key] for name in review_names
+              for key in data_type_fields(name, data) + [name + EVIDENCE_SUFFIX] if key in data}
+    return find_incorrect_data_types(str(review), corpus, review_names, model=model)
 
 
 def remove_failed_data(data):
-    successfull_keys = []
-    for key, value in data.items():
-        if key.endswith("_successfully_extracted"):
-            if value:
-                successfull_keys.append(key.replace("_successfully_extracted", ""))
     new_data = {}
-    for key in successfull_keys:
-        for k, v in data.items():
-            if k.startswith(key) and not k.endswith("_successfully_extracted"):
-                new_data[k] = v
+    for name in data_type_names(data):
+        if data[name + SUCCESS_SUFFIX]:
+            new_data.update({key: data[key] for key in data_type_fields(name, data)})
     return new_data
 
 
-def extract_data(tools, corpus, retries=5):
-
+def extract_data(tools, corpus, retries=5, model=EXTRACTION_MODEL, verification=EXTRACTION_VERIFICATION):
+    """
+    Extracts the tool's data types from the corpus. Data types that verify are kept; the ones that fail
+    verification are asked for again with a tool reduced to just those data types, for up to retries requests
+    in all. A data type the model reports as not extracted is asked for once more, then accepted as not found.
+    Returns the extracted data without its success flags and evidence quotes, or None.
+    """
     system_message = "You are an careful data analyst. Dutifully find the data in the provided research paper."
 
     user_message = "Extract the requested data using the extract_data tool:\n\n" + corpus + "\n"
@@ -437,31 +603,47 @@ def extract_data(tools, corpus, retries=5):
         }
     ]
 
-    arguments = {"messages": messages, "tools": tools, "model": "gpt-4o",
-                 "tool_choice": {"type": "function", "function": {"name": "extract_data"}}}
+    if verification == "quotes":
+        tools = add_evidence_fields(tools)
+    properties = tool_fields(tools)
+    pending = data_type_names(properties)
+    not_found = set()
+    kept = {}
 
     retry = 0
-    valid_calls = []
-    output_dictionary = None
-    while valid_calls == [] and retry < retries:
+    while pending and retry < retries:
         if retry > 0:
-            print("Retrying...")
+            print(f"Retrying {', '.join(pending)}...")
+        request_tools = tools if retry == 0 else \
+            subset_tool(tools, [field for name in pending for field in data_type_fields(name, properties)] +
+                        [name + suffix for name in pending for suffix in (SUCCESS_SUFFIX, EVIDENCE_SUFFIX)])
+        arguments = {"messages": messages, "tools": request_tools, "model": model,
+                     "tool_choice": {"type": "function", "function": {"name": "extract_data"}}}
         chat_response = client.chat.completions.create(**arguments)
-        if chat_response.choices[0].message.tool_calls:
-            valid_calls = use_tools(chat_response, arguments, call_functions=False)
-            if valid_calls:
-                for call in valid_calls:
-                    if call["name"] == "extract_data":
-                        output_dictionary = call["parameters"]
-                        output_dictionary = remove_failed_data(output_dictionary)
-                        check = reflect_on_data_extraction(str(output_dictionary), corpus)
-                        if not check:
-                            print("Data extraction failed. Retrying...")
-                            valid_calls = []
-        else:
-            print("No tool calls used")
         retry += 1
-        if output_dictionary:
-            return output_dictionary
+        if not chat_response.choices[0].message.tool_calls:
+            print("No tool calls used")
+            continue
+        for call in use_tools(chat_response, arguments, call_functions=False):
+            if call["name"] != "extract_data":
+                continue
+            output = call["parameters"]
+            extracted = [name for name in pending if output.get(name + SUCCESS_SUFFIX)]
+            rejected = rejected_data_types({key: output[key] for name in extracted
+                                            for key in data_type_fields(name, output) +
+                                            [name + SUCCESS_SUFFIX, name + EVIDENCE_SUFFIX] if key in output},
+                                           corpus, verification=verification, model=model)
+            for name in extracted:
+                if name not in rejected:
+                    kept.update({key: output[key] for key in data_type_fields(name, output)})
+                    kept[name + SUCCESS_SUFFIX] = True
+            missing = [name for name in pending if name not in extracted]
+            pending = [name for name in pending if name in rejected or name not in extracted and name not in not_found]
+            not_found.update(missing)
+            if rejected:
+                print(f"Data extraction failed for {', '.join(rejected)}")
+            break
+    output_dictionary = remove_failed_data(kept)
+    if output_dictionary:
+        return output_dictionary
     return None
-
@@ -1,15 +1,37 @@
+import multiprocessing
 import os
 import shutil
-import time
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 from datetime import datetime
 import asyncio
 import hashlib
+from contextlib import contextmanager
 import pandas as pd
 from pandas import json_normalize
-import dictdatabase as DDB
+from .blob_store import BlobStore
+from .change_feed import ChangeFeed
+from .checkpoint_store import CheckpointStore, CHECKPOINT_STORE
+from .document_cache import DocumentCache
+from .storage import DDBStorage, SQLiteStorage, SQLITE_FILENAME, SQLITE_NAMED_TABLES, migrate_ddb_to_sqlite
 
 lock_files = []
 
+PAPER_WORKERS = 4
+RENDER_WORKERS = 2
+HASH_WORKERS = 8
+
+DEFAULT_STORAGE_ENGINE = "ddb"
+STORAGE_ENGINES = ["ddb", "sqlite"]
+# engine for projects that have no SQLite database yet, inherited by the backend processes
+STORAGE_ENGINE_VARIABLE = "SCIENCEAI_STORAGE_ENGINE"
+
+# lightweight per paper fields kept in the paper_index file so hot reads never open the full paper files
+INDEXED_FIELDS = ["title", "doi", "authors", "date", "journal", "summary"]
+# paper fields build_index_entry reads, a write to any of them rebuilds the paper's index entry
+INDEX_SOURCE_FIELDS = ["metadata", "summary"]
+
 
 def sha256sum(filename):
     h = hashlib.sha256()
@@ -21,6 +43,24 @@ def sha256sum(filename):
     return h.hexdigest()
 
 
+def build_index_entry(dict_data):
+    metadata = dict_data.get("metadata") or {}
+    authors = []
+    for author in metadata.get("author", []):
+        authors.append({"given": author.get("given", ""), "family": author.get("family", author.get("name", ""))})
+    date = None
+    if metadata.get("created") and metadata["created"].get("date-time"):
+        date = metadata["created"]["date-time"][:10]
+    return {
+        "title": metadata["title"][0] if metadata.get("title") else None,
+        "doi": metadata.get("DOI"),
+        "authors": authors,
+        "date": date,
+        "journal": metadata["container-title"][0] if metadata.get("container-title") else None,
+        "summary": dict_data.get("summary"),
+    }
+
+
 def get_projects(storage_path):
     projects = []
     if os.path.basename(storage_path) != "scienceai_db":
@@ -28,7 +68,8 @@ def get_projects(storage_path):
     if not os.path.exists(storage_path):
         return projects
     for project in os.listdir(storage_path):
-        if os.path.isdir(os.path.join(storage_path, project)) and project.find("_-checkpoint-_") == -1:
+        if os.path.isdir(os.path.join(storage_path, project)) and project.find("_-checkpoint-_") == -1 and \
+                project != CHECKPOINT_STORE:
             projects.append(project)
     return projects
 
@@ -36,7 +77,8 @@ def get_projects(storage_path):
 # Paper Manager
 class DatabaseManager:
     def __init__(self, input_pdf_directory, processor, project_name, storage_path=None, auto_prune=False,
-                 read_only_mode=False, lock_timeout=60):
+                 read_only_mode=False, lock_timeout=60, storage_engine=None,
+                 watch_changes=False):
         if read_only_mode:
             self.auto_prune = False
         else:
@@ -61,125 +103,320 @@ class DatabaseManager:
         self.papers_pdf_path = os.path.join(self.project_path, "papers_pdf")
         if not os.path.exists(self.papers_pdf_path):
             os.makedirs(self.papers_pdf_path)
+        self.blob_store = BlobStore(os.path.join(self.project_path, "page_blobs"))
+        self.checkpoint_store = CheckpointStore(os.path.join(self.storage_path, CHECKPOINT_STORE, project_name))
         self.db_path = os.path.join(self.project_path, "scienceai_ddb")
-        DDB.config.storage_directory = self.db_path
+        self.storage = self.open_storage(storage_engine)
+        self._write_lock = threading.RLock()
         self.update_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        if not DDB.at("update_time").exists():
-            DDB.at("update_time").create({})
-        with DDB.at("update_time").session() as (session, update_time):
-            update_time[project_name] = self.update_time
-            session.write()
+        self.changes = ChangeFeed.for_path(os.path.join(self.project_path, "changes"))
+        if watch_changes:
+            self.changes.watch_files = True
+        # a read only manager that does not watch the change files would never see another process's writes
+        self.cache = DocumentCache() if watch_changes or not read_only_mode else None
+        self._writing = threading.local()
+        self._transaction = None
         self.default_schema = ["metadata", "papers", "pi_context"]
         self.project_name = project_name
         if not read_only_mode:
             self.__initialize_db__()
     
-    def log_update(func):
-        def wrapper(self, *args, **kwargs):
-            if self.read_only_mode:
-                raise ValueError("Database is in read only mode")
-            self.update_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            if not DDB.at("update_time").exists():
-                DDB.at("update_time").create({self.project_name: self.update_time})
-            else:
-                with DDB.at("update_time").session() as (session, update_time):
-                    update_time[self.project_name] = self.update_time
-                    session.write()
-            result = func(self, *args, **kwargs)
-            return result
-        return wrapper
-
-    async def await_update(self, timeout=None):
-        DDB.config.storage_directory = self.db_path
-        start = time.time()
-        original_update_time = self.update_time
-        while timeout is None or time.time() - start < timeout:
-            await asyncio.sleep(.3)
-            if not DDB.at("update_time").exists():
-                DDB.at("update_time").create({self.project_name: original_update_time})
-                update_time = original_update_time
-            else:
-                update_time = DDB.at("update_time").read().get(self.project_name, "")
-            if len(update_time) > 11:
-                if update_time != original_update_time:
-                    self.update_time = update_time
-                    break
+    def open_storage(self, storage_engine=None):
+        """
+        Opens the project's storage engine. A project that has a SQLite database always uses it, otherwise the
+        engine is storage_engine, the SCIENCEAI_STORAGE_ENGINE environment variable, or DEFAULT_STORAGE_ENGINE.
+        Choosing sqlite for a DDB project migrates its documents on the first writable open.
+        """
+        sqlite_path = os.path.join(self.project_path, SQLITE_FILENAME)
+        if storage_engine is None:
+            storage_engine = "sqlite" if os.path.exists(sqlite_path) else \
+                os.environ.get(STORAGE_ENGINE_VARIABLE, DEFAULT_STORAGE_ENGINE)
+        if storage_engine == "ddb":
+            return DDBStorage(self.db_path)
+        if storage_engine not in STORAGE_ENGINES:
+            raise ValueError(f"Unknown storage engine {storage_engine}")
+        if not os.path.exists(self.db_path):
+            os.makedirs(self.db_path)
+        has_ddb_files = any(file.endswith(".json") for file in os.listdir(self.db_path))
+        storage = SQLiteStorage(sqlite_path, db_path=self.db_path)
+        if has_ddb_files and storage.is_empty() and not self.read_only_mode:
+            storage = migrate_ddb_to_sqlite(self.db_path, sqlite_path)
+        return storage
+
+    def materialize(self, path):
+        """ Makes sure a document path handed to the UI is on disk and current, returns the path """
+        if self.storage.engine == "ddb" or not path.endswith(".json"):
+            return path
+        relative = os.path.relpath(path, self.db_path)
+        if relative.startswith(".."):
+            return path
+        name = relative[:-len(".json")].replace(os.sep, "/")
+        table = self.document_table(name)
+        if table is None:
+            return path
+        return self.storage.materialize(name, table=table)
+
+    def document_table(self, name):
+        """ Returns the SQLite table of the project document with this name, None if there is no such document """
+        if name in SQLITE_NAMED_TABLES:
+            return SQLITE_NAMED_TABLES[name]
+        if name.startswith("extractions/"):
+            return "extractions"
+        if self.storage.at("papers", key=name).exists():
+            return "paper_documents"
+        analysts = self._read("analysts", "Analysts") or {}
+        if name in analysts:
+            return "contexts"
+        for analyst in analysts.values():
+            if any(tool["json_path"] == name + ".json" for tool in analyst.get("tools", [])):
+                return "trackers"
+        return None
+
+    def log_update(*collections):
+        """ Marks a method that writes to the database, readers waiting on these collections are woken after it """
+        def decorator(func):
+            def wrapper(self, *args, **kwargs):
+                if self.read_only_mode:
+                    raise ValueError("Database is in read only mode")
+                # writes are serialized so concurrent paper workers can not clobber shared files like papers
+                with self._write_lock:
+                    self.update_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                    self._writing.depth = getattr(self._writing, "depth", 0) + 1
+                    try:
+                        result = func(self, *args, **kwargs)
+                    finally:
+                        self._writing.depth -= 1
+                    if self._transaction is not None:
+                        self._transaction["collections"].update(collections)
+                    else:
+                        self.changes.notify(collections, self.update_time)
+                return result
+            return wrapper
+        return decorator
+
+    @contextmanager
+    def transaction(self):
+        """
+        Groups the writes made inside it into one storage write and one change notification. Other threads'
+        writes wait until it ends, and if it raises the SQLite engine rolls back and the DDB engine writes
+        nothing. Nested transactions join the outer one.
+        """
+        if self.read_only_mode:
+            raise ValueError("Database is in read only mode")
+        with self._write_lock:
+            if self._transaction is not None:
+                yield self
+                return
+            self._transaction = {"collections": set(), "paper_ids": []}
+            self._writing.depth = getattr(self._writing, "depth", 0) + 1
+            try:
+                with self.storage.transaction():
+                    yield self
+                    if self._transaction["paper_ids"]:
+                        self._bump_paper_versions(self._transaction["paper_ids"])
+            finally:
+                collections = self._transaction["collections"]
+                self._transaction = None
+                self._writing.depth -= 1
+                if collections:
+                    self.changes.notify(collections, self.update_time)
+
+    def _read(self, collection, name, key=None, table=None):
+        """
+        Reads a document through the cache, which is invalidated when a write to its collection is logged.
+        Writes read straight from storage, they may have changed the document without notifying yet.
+        """
+        if self.cache is None or getattr(self._writing, "depth", 0):
+            return self.storage.at(name, key=key, table=table).read()
+        version = self.changes.versions()[collection]
+        found, document = self.cache.get((name, key), version)
+        if not found:
+            document = self.storage.at(name, key=key, table=table).read()
+            self.cache.put((name, key), version, document)
+        return document
+
+    def cache_stats(self):
+        """ Returns the document cache's hits, misses, entries, and hit_rate """
+        if self.cache is None:
+            return {"hits": 0, "misses": 0, "entries": 0, "hit_rate": 0.0}
+        return self.cache.stats()
+
+    def wait_for_update(self, versions=None, collections=None, timeout=None):
+        """
+        Blocks until one of collections ("chat", "papers", "analysts", all by default) changes after versions, as
+        returned by self.changes.versions() or a previous call, or until timeout. Returns the new versions.
+        """
+        if versions is None:
+            versions = self.changes.versions()
+        return self.changes.wait(versions, collections=collections, timeout=timeout)
+
+    async def await_update(self, timeout=None, collections=None):
+        await asyncio.to_thread(self.wait_for_update, collections=collections, timeout=timeout)
 
     def update_update_time(self):
-        temp_update_time = DDB.at("update_time").read().get(self.project_name, "")
-        if len(temp_update_time) > 11:
+        temp_update_time = self.changes.last_update_time()
+        if temp_update_time:
             self.update_time = temp_update_time
 
     def get_update_time(self):
         self.update_update_time()
         return self.update_time
 
-    @log_update
+    @log_update("chat", "papers", "analysts")
     def __initialize_db__(self):
-        DDB.config.storage_directory = self.db_path
-        if not DDB.at("metadata").exists():
-            DDB.at("metadata").create({})
-        with DDB.at("metadata").session() as (session, metadata):
+        if not self.storage.at("metadata").exists():
+            self.storage.at("metadata").create({})
+        with self.storage.at("metadata").session() as (session, metadata):
             metadata[self.project_name] = {"loaded": True}
             for project in os.listdir(self.storage_path):
-                if project != self.project_name:
+                if project != self.project_name and project != CHECKPOINT_STORE:
                     if os.path.isdir(os.path.join(self.storage_path, project)):
                         if project not in metadata:
                             metadata[project] = {"loaded": False}
                         else:
                             metadata[project]["loaded"] = False
             session.write()
+        self.migrate_to_logs()
+        self.compact_logs()
+        if not self.storage.at("paper_index").exists():
+            self.storage.at("paper_index").create({})
+        if self.storage.at("papers").exists():
+            indexed = self.storage.at("paper_index").read()
+            missing = {paper_id: build_index_entry(self.storage.at(paper_id, table="paper_documents").read())
+                       for paper_id in self.storage.at("papers").read()
+                       if paper_id not in indexed and self.storage.at(paper_id, table="paper_documents").exists()}
+            if missing:
+                with self.storage.at("paper_index").session() as (session, index):
+                    index.update(missing)
+                    session.write()
+            for paper_id in self.storage.at("papers").read():
+                if self.storage.at(paper_id, key="page_images", table="paper_documents").exists():
+                    with self.storage.at(paper_id, table="paper_documents").session() as (session, paper_data):
+                        paper_data["page_image_refs"] = [self.blob_store.put_data_url(image)
+                                                         for image in paper_data.pop("page_images")]
+                        session.write()
+
+    def compact_logs(self):
+        """ Drops the superseded entries of the project's logs, such as every progress update of a chat message """
+        log_names = ["chat"]
+        if self.storage.at("Analysts").exists():
+            log_names += ["contexts/" + name for name in self.storage.at("Analysts").read()]
+        for log_name in log_names:
+            self.storage.log(log_name).compact()
 
-    @log_update
+    def migrate_to_logs(self):
+        """ Moves chat messages and analyst contexts stored inside documents into append only logs """
+        moves = [("chat", "chat", "messages", "chat")]
+        if self.storage.at("Analysts").exists():
+            moves += [("contexts/" + name, name, "context", "contexts") for name in self.storage.at("Analysts").read()]
+        for log_name, name, key, table in moves:
+            if not self.storage.at(name, table=table).exists() or \
+                    not self.storage.at(name, key=key, table=table).exists():
+                continue
+            log = self.storage.log(log_name)
+            with self.storage.at(name, table=table).session() as (session, document):
+                if len(log) == 0:
+                    for record in document[key]:
+                        log.append(record)
+                del document[key]
+                session.write()
+
+    @log_update("chat")
     def remove_old_default_messages(self, default_messages):
-        if not DDB.at("chat").exists():
-            DDB.at("chat").create({})
-        if default_messages and DDB.at("chat", key="messages").exists():
-            current_messages = DDB.at("chat", key="messages").read()
+        if not self.storage.at("chat").exists():
+            self.storage.at("chat").create({})
+        if default_messages and self.storage.at("chat", key="messages").exists():
+            current_messages = self.storage.at("chat", key="messages").read()
             index = len(current_messages) - len(default_messages)
             last_message = current_messages[index:]
             last_content = [message["content"] for message in last_message]
             if last_content == default_messages:
-                with DDB.at("chat", key="messages").session() as (session, messages):
+                with self.storage.at("chat", key="messages").session() as (session, messages):
                     messages = current_messages[:index]
                     session.write()
 
-    @log_update
     def ingest_paper(self, pdf_path):
-        if not os.path.exists(pdf_path):
-            raise ValueError(f"File {pdf_path} does not exist")
-        paper_id = sha256sum(pdf_path)
-        filename = paper_id + ".pdf"
-        stored_pdf_path = os.path.join(self.papers_pdf_path, filename)
+        return self.ingest_papers_bulk([pdf_path])[0]
+
+    def _store_pdf(self, pdf_path, paper_id=None):
+        """ Hashes the PDF unless its paper_id is known and copies it into the project if needed, returns the id """
+        if paper_id is None:
+            paper_id = sha256sum(pdf_path)
+        stored_pdf_path = os.path.join(self.papers_pdf_path, paper_id + ".pdf")
         if not os.path.exists(stored_pdf_path):
-            shutil.copy(pdf_path, stored_pdf_path)
-        if not DDB.at('papers').exists():
-            DDB.at('papers').create({})
-        with DDB.at('papers').session() as (session, papers):
-            if paper_id not in papers:
-                papers[paper_id] = {"pdf_path": stored_pdf_path, "paper_id": paper_id}
-            else:
-                papers[paper_id].update({"pdf_path": stored_pdf_path})
-            session.write()
+            # two files with the same content may be copied at once, each goes through its own temp file
+            temp_path = f"{stored_pdf_path}.{threading.get_ident()}.tmp"
+            shutil.copy(pdf_path, temp_path)
+            os.replace(temp_path, stored_pdf_path)
         return paper_id
 
+    @log_update("papers")
+    def ingest_papers_bulk(self, pdf_paths):
+        """
+        Copies the PDFs into the project and registers them all in one write, returns their paper ids. The
+        ingest_manifest document maps each PDF's path, size, and mtime to its paper id, so files that did not
+        change since they were last ingested are not hashed again; the others are hashed in parallel.
+        """
+        for pdf_path in pdf_paths:
+            if not os.path.exists(pdf_path):
+                raise ValueError(f"File {pdf_path} does not exist")
+        if not pdf_paths:
+            return []
+        manifest = self.storage.at("ingest_manifest").read() or {}
+        stats = {pdf_path: os.stat(pdf_path) for pdf_path in pdf_paths}
+        known = {}
+        for pdf_path, stat in stats.items():
+            entry = manifest.get(os.path.abspath(pdf_path))
+            if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+                known[pdf_path] = entry["paper_id"]
+        with ThreadPoolExecutor(max_workers=HASH_WORKERS) as executor:
+            paper_ids = list(executor.map(lambda pdf_path: self._store_pdf(pdf_path, known.get(pdf_path)), pdf_paths))
+        manifest_updates = {os.path.abspath(pdf_path): {"size": stats[pdf_path].st_size,
+                                                        "mtime_ns": stats[pdf_path].st_mtime_ns,
+                                                        "paper_id": paper_id}
+                            for pdf_path, paper_id in zip(pdf_paths, paper_ids) if pdf_path not in known}
+        papers = self.storage.at("papers").read() or {}
+        stored = {paper_id: os.path.join(self.papers_pdf_path, paper_id + ".pdf") for paper_id in paper_ids}
+        changed = [paper_id for paper_id, stored_pdf_path in stored.items()
+                   if papers.get(paper_id, {}).get("pdf_path") != stored_pdf_path]
+        with self.storage.transaction():
+            if changed:
+                if not self.storage.at('papers').exists():
+                    self.storage.at('papers').create({})
+                with self.storage.at('papers').session() as (session, papers):
+                    for paper_id in changed:
+                        if paper_id not in papers:
+                            papers[paper_id] = {"pdf_path": stored[paper_id], "paper_id": paper_id}
+                        else:
+                            papers[paper_id].update({"pdf_path": stored[paper_id]})
+                    session.write()
+            if manifest_updates:
+                if not self.storage.at("ingest_manifest").exists():
+                    self.storage.at("ingest_manifest").create({})
+                with self.storage.at("ingest_manifest").session() as (session, manifest):
+                    manifest.update(manifest_updates)
+                    session.write()
+        if changed:
+            self.papers_changed(*changed)
+        print(f"Ingested {len(pdf_paths)} papers: {len(pdf_paths) - len(known)} hashed, {len(changed)} registered")
+        return paper_ids
+
     def ingest_papers(self):
-        found_papers = []
-        for file in os.listdir(self.input_pdf_directory):
-            if file.endswith(".pdf"):
-                pdf_path = os.path.join(self.input_pdf_directory, file)
-                found_papers.append(self.ingest_paper(pdf_path))
-        if self.auto_prune and DDB.at("papers").exists():
-            papers = DDB.at("papers").read()
-            prune_papers = [paper['paper_id'] for paper in papers if paper['paper_id'] not in found_papers]
-            for paper_id in prune_papers:
-                self.prune_paper(paper_id)
+        pdf_paths = [os.path.join(self.input_pdf_directory, file) for file in os.listdir(self.input_pdf_directory)
+                     if file.endswith(".pdf")]
+        found_papers = self.ingest_papers_bulk(pdf_paths)
+        if self.auto_prune and self.storage.at("papers").exists():
+            papers = self.storage.at("papers").read()
+            prune_papers = [paper_id for paper_id in papers if paper_id not in found_papers]
+            with self.transaction():
+                for paper_id in prune_papers:
+                    self.prune_paper(paper_id)
         return found_papers
 
-    @log_update
+    @log_update("papers")
     def prune_paper(self, paper_id):
-        if DDB.at("papers", key=paper_id).exists():
-            with DDB.at("papers").session() as (session, papers):
+        if self.storage.at("papers", key=paper_id).exists():
+            with self.storage.at("papers").session() as (session, papers):
                 paths = papers[paper_id]
                 if 'pdf_path' in paths and os.path.exists(paths['pdf_path']):
                     os.remove(paths['pdf_path'])
@@ -187,18 +424,67 @@ class DatabaseManager:
                     os.remove(paths['json_path'])
                 del papers[paper_id]
                 session.write()
+            self.papers_changed(paper_id)
+        if self.storage.at("paper_index", key=paper_id).exists():
+            with self.storage.at("paper_index").session() as (session, index):
+                del index[paper_id]
+                session.write()
 
-    @log_update
     def update_paper(self, paper_id, paper_metadata):
-        if DDB.at("papers", key=paper_id).exists():
-            with DDB.at("papers").session() as (session, papers):
-                papers[paper_id].update(paper_metadata)
+        self.update_papers({paper_id: paper_metadata})
+
+    @log_update("papers")
+    def update_papers(self, updates):
+        """ Applies {paper_id: paper_metadata} updates in one write, papers that are not in the database are skipped """
+        if not self.storage.at("papers").exists():
+            return
+        with self.storage.at("papers").session() as (session, papers):
+            updated = [paper_id for paper_id in updates if paper_id in papers]
+            for paper_id in updated:
+                papers[paper_id].update(updates[paper_id])
+            session.write()
+            reindex = {paper_id: papers[paper_id] for paper_id in updated
+                       if any(field in updates[paper_id] for field in INDEX_SOURCE_FIELDS)}
+        if reindex and self.storage.at("paper_index").exists():
+            with self.storage.at("paper_index").session() as (session, index):
+                for paper_id, paper in reindex.items():
+                    index[paper_id] = build_index_entry(self._index_source(paper_id, paper))
                 session.write()
+        if updated:
+            self.papers_changed(*updated)
+
+    def _index_source(self, paper_id, paper):
+        """ The paper's processed data with any metadata or summary written to its database entry on top """
+        data = {}
+        if self.storage.at(paper_id, table="paper_documents").exists():
+            data = self.storage.at(paper_id, table="paper_documents").read()
+        overrides = {field: paper[field] for field in INDEX_SOURCE_FIELDS if field in paper}
+        return {**data, **overrides} if overrides else data
+
+    def papers_changed(self, *paper_ids):
+        """ Records that these papers were added, edited, or removed so readers can fetch just those rows """
+        if self._transaction is not None:
+            self._transaction["paper_ids"].extend(paper_ids)
+            return
+        self._bump_paper_versions(paper_ids)
+
+    def _bump_paper_versions(self, paper_ids):
+        """
+        paper_versions maps every paper ever stored to the project version it last changed at, so it holds one
+        number per paper however often papers change. Removed papers keep theirs to tell readers they are gone.
+        """
+        if not self.storage.at("paper_versions").exists():
+            self.storage.at("paper_versions").create({})
+        with self.storage.at("paper_versions").session() as (session, versions):
+            version = max(versions.values(), default=0) + 1
+            for paper_id in paper_ids:
+                versions[paper_id] = version
+            session.write()
 
     def get_paper(self, paper_id):
-        if not DDB.at("papers", key=paper_id).exists():
+        if not self.storage.at("papers", key=paper_id).exists():
             raise ValueError(f"Paper with id {paper_id} not found")
-        return DDB.at("papers", key=paper_id).read()
+        return self.storage.at("papers", key=paper_id).read()
 
     def get_paper_pdf(self, paper_id):
         paper = self.get_paper(paper_id)
@@ -208,12 +494,36 @@ class DatabaseManager:
         paper = self.get_paper(paper_id)
         return paper.get("json_path", None)
 
-    @log_update
+    def externalize_page_images(self, dict_data):
+        """ Moves base64 page images into the blob store, leaving only their references in the paper data """
+        if "page_images" not in dict_data:
+            return dict_data
+        dict_data = dict(dict_data)
+        dict_data["page_image_refs"] = [self.blob_store.put_data_url(image) for image in dict_data.pop("page_images")]
+        return dict_data
+
+    def get_page_images(self, paper_id, as_data_url=True):
+        if not self.storage.at(paper_id, table="paper_documents").exists():
+            raise ValueError(f"Paper with id {paper_id} has not been processed")
+        refs = self.storage.at(paper_id, key="page_image_refs", table="paper_documents").read()
+        if refs is None:
+            return self.storage.at(paper_id, key="page_images", table="paper_documents").read() or []
+        if as_data_url:
+            return [self.blob_store.get_data_url(ref) for ref in refs]
+        return [self.blob_store.path(ref) for ref in refs]
+
+    @log_update("papers")
     def store_paper_json(self, paper_id, dict_data):
         paper = self.get_paper(paper_id)
-        if not DDB.at(paper_id).exists():
-            DDB.at(paper_id).create(dict_data)
-        with DDB.at("papers").session() as (session, papers):
+        dict_data = self.externalize_page_images(dict_data)
+        if not self.storage.at(paper_id, table="paper_documents").exists():
+            self.storage.at(paper_id, table="paper_documents").create(dict_data)
+        if not self.storage.at("paper_index").exists():
+            self.storage.at("paper_index").create({})
+        with self.storage.at("paper_index").session() as (session, index):
+            index[paper_id] = build_index_entry(dict_data)
+            session.write()
+        with self.storage.at("papers").session() as (session, papers):
             papers[paper_id] = paper
             if dict_data.get("metadata"):
                 added = {}
@@ -226,91 +536,125 @@ class DatabaseManager:
                         "family"]
                 papers[paper_id].update(added)
             session.write()
+        self.papers_changed(paper_id)
         return True
 
-    @log_update
-    def process_paper(self, paper_id):
+    def process_paper(self, paper_id, **processor_kwargs):
         """ Processes the paper
 
         Returns:
             string: path to the paper
 
         """
+        if self.read_only_mode:
+            raise ValueError("Database is in read only mode")
         pdf_path = self.get_paper_pdf(paper_id)
-        if not DDB.at(paper_id).exists():
-            processed_paper = self.processor(pdf_path)
+        if not self.storage.at(paper_id, table="paper_documents").exists():
+            processed_paper = self.processor(pdf_path, **processor_kwargs)
             self.store_paper_json(paper_id, processed_paper)
 
-    def process_all_papers(self):
+    def process_all_papers(self, max_workers=PAPER_WORKERS, render_workers=RENDER_WORKERS, progress_callback=None):
         """ Processes all the papers
 
+        Papers are processed by a pool of max_workers threads. When render_workers is set the PDF pages are
+        rendered in a separate pool of processes that is handed to the processor as render_executor.
+        progress_callback is called with (completed, total, paper_id, error) as each paper finishes.
+
         Returns:
-            string: path to the paper
+            bool: True once every paper has been processed
 
         """
         print("Processing all papers")
-        paper_ids = list(DDB.at("papers").read().keys())
-        for paper_id in paper_ids:
-            print(f"Processing paper {paper_id}")
-            self.process_paper(paper_id)
+        paper_ids = list((self.storage.at("papers").read() or {}).keys())
+        total = len(paper_ids)
+        completed = 0
+        errors = []
+        # spawn rather than fork, the scheduler, change feed and paper threads are already running by now
+        render_executor = None
+        if render_workers:
+            render_executor = ProcessPoolExecutor(max_workers=render_workers,
+                                                  mp_context=multiprocessing.get_context("spawn"))
+        processor_kwargs = {"render_executor": render_executor} if render_executor else {}
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = {}
+                for paper_id in paper_ids:
+                    print(f"Processing paper {paper_id}")
+                    futures[executor.submit(self.process_paper, paper_id, **processor_kwargs)] = paper_id
+                for future in as_completed(futures):
+                    paper_id = futures[future]
+                    completed += 1
+                    error = future.exception()
+                    if error:
+                        print(f"Failed to process paper {paper_id}")
+                        traceback.print_exception(error)
+                        errors.append(error)
+                    if progress_callback:
+                        progress_callback(completed, total, paper_id, error)
+        finally:
+            if render_executor:
+                render_executor.shutdown()
+        if errors:
+            raise errors[0]
         return True
 
-    @log_update
+    @log_update("chat")
     def add_chat(self, message):
-        with DDB.at("chat").session() as (session, chat):
-            if "messages" not in chat:
-                chat["messages"] = []
-            chat["messages"].append(message)
-            session.write()
+        self.storage.log("chat").append(message)
         return True
 
-    @log_update
-    def update_last_chat(self, status, full_update=None):
-        with DDB.at("chat").session() as (session, chat):
-            if "messages" in chat:
-                if full_update:
-                    chat["messages"][-1] = full_update
-                chat["messages"][-1]["status"] = status
-                session.write()
+    @log_update("chat")
+    def update_last_chat(self, status, full_update=None, progress=None):
+        chat_log = self.storage.log("chat")
+        message = chat_log.last()
+        if message is not None:
+            current = dict(message)
+            if full_update:
+                message = full_update
+            message["status"] = status
+            if progress is not None:
+                message["progress"] = progress
+            # repeated status ticks would each append a copy of the message
+            if message != current:
+                chat_log.update_last(message)
         return True
 
-    @log_update
+    @log_update("analysts")
     def create_analyst(self, name, goal, other={}):
-        if not DDB.at("Analysts").exists():
-            DDB.at("Analysts").create({})
-        if not DDB.at(name).exists():
-            DDB.at(name).create({})
-        with DDB.at("Analysts").session() as (session, analysts):
-            if name not in analysts:
+        if not self.storage.at("Analysts").exists():
+            self.storage.at("Analysts").create({})
+        if not self.storage.at(name, table="contexts").exists():
+            self.storage.at(name, table="contexts").create({})
+        with self.storage.at("Analysts").session() as (session, analysts):
+            created = name not in analysts
+            if created:
                 analysts[name] = {"goal": goal, **other}
             session.write()
-        with DDB.at(name).session() as (session, analyst):
-            analyst["context"] = []
-            session.write()
+        # an existing analyst keeps its context, resume_collections may just have recorded calls in it
+        if created:
+            self.storage.log("contexts/" + name).clear()
         return True
 
-    @log_update
+    @log_update("analysts")
     def add_analyst_context(self, name, analyst_context):
-        if not DDB.at(name).exists():
-            DDB.at(name).create({})
-        if not DDB.at(name).exists():
+        if not self.storage.at(name, table="contexts").exists():
+            self.storage.at(name, table="contexts").create({})
+        if not self.storage.at(name, table="contexts").exists():
             raise ValueError(f"Analyst {name} not found")
-        with DDB.at(name).session() as (session, analyst):
-            analyst["context"].append(analyst_context)
-            session.write()
+        self.storage.log("contexts/" + name).append(analyst_context)
         return True
 
-    @log_update
+    @log_update("analysts")
     def add_analyst_tool_tracker(self, analyst_name, tool_name, json_data={}):
         tool_time = datetime.now().strftime("%Y-%m-%d_%H_%M_%S")
         tool_fullname = analyst_name+"_/"+tool_name + "_" + tool_time
-        if not DDB.at(tool_fullname).exists():
-            DDB.at(tool_fullname).create(json_data)
+        if not self.storage.at(tool_fullname, table="trackers").exists():
+            self.storage.at(tool_fullname, table="trackers").create(json_data)
         else:
-            with DDB.at(tool_fullname).session() as (session, tool):
+            with self.storage.at(tool_fullname, table="trackers").session() as (session, tool):
                 tool.update(json_data)
                 session.write()
-        with DDB.at("Analysts").session() as (session, analysts):
+        with self.storage.at("Analysts").session() as (session, analysts):
             if analyst_name not in analysts:
                 raise ValueError(f"Analyst {analyst_name} not found")
             if "tools" not in analysts[analyst_name]:
@@ -319,17 +663,17 @@ class DatabaseManager:
             session.write()
         return tool_fullname
 
-    @log_update
+    @log_update("analysts")
     def convert_analyst_tool_tracker(self, analyst_name, tool_name):
-        if not DDB.at("Analysts", key=analyst_name).exists():
+        if not self.storage.at("Analysts", key=analyst_name).exists():
             raise ValueError(f"Analyst {analyst_name} not found")
         data = None
-        with DDB.at("Analysts", key=analyst_name).session() as (session, analyst):
+        with self.storage.at("Analysts", key=analyst_name).session() as (session, analyst):
             for i, tool in enumerate(analyst["tools"]):
                 if tool["tool_name"] == tool_name:
                     data_path = tool["json_path"]
-                    data = DDB.at(data_path.replace(".json", "")).read()
-                    data = list({k: {**{"id": k[10:]}, **v} for k, v in data.items()}.values())
+                    data = self.storage.at(data_path.replace(".json", ""), table="trackers").read()
+                    data = list({k: {**{"id": k[10:]}, **(v or {})} for k, v in data.items()}.values())
                     flat_data = json_normalize(data)
                     csv_path = data_path.replace(".json", ".csv")
                     csv_folder = os.path.join(self.project_path, "csv_files")
@@ -345,15 +689,15 @@ class DatabaseManager:
         return csv_path
 
     def combine_analyst_tool_trackers(self):
-        if not DDB.at("Analysts").exists():
+        if not self.storage.at("Analysts").exists():
             df = pd.DataFrame({"Notes": ["No Analysts have been created yet. After they are created, results of their"
                                          " data extraction will be combined and accessible under the "
                                          "'Extracted Data' tab."]})
             df.to_csv(os.path.join(self.project_path, "merged_analyst_tools.csv"), index=False)
             return os.path.join(self.project_path, "merged_analyst_tools.csv")
         csv_paths = {}
-        for analyst_name in DDB.at("Analysts").read():
-            analyst = DDB.at("Analysts", key=analyst_name).read()
+        for analyst_name in self.storage.at("Analysts").read():
+            analyst = self.storage.at("Analysts", key=analyst_name).read()
             if "tools" in analyst:
                 for tool in analyst["tools"]:
                     if "csv_path" in tool:
@@ -400,12 +744,12 @@ class DatabaseManager:
         merged_df.to_csv(os.path.join(self.project_path, "merged_analyst_tools.csv"), index=False)
         return os.path.join(self.project_path, "merged_analyst_tools.csv")
 
-    @log_update
+    @log_update("analysts")
     def update_analyst_tool_tracker(self, json_path, key, update_data, overwrite_list=False):
         json_path = json_path.replace(".json", "")
-        if not DDB.at(json_path).exists():
+        if not self.storage.at(json_path, table="trackers").exists():
             raise ValueError(f"File {json_path} does not exist")
-        with DDB.at(json_path).session() as (session, data):
+        with self.storage.at(json_path, table="trackers").session() as (session, data):
             if key not in data:
                 data[key] = update_data
             elif isinstance(data[key], dict):
@@ -421,51 +765,89 @@ class DatabaseManager:
             session.write()
         return True
 
-    @log_update
+    @log_update("analysts")
     def add_analyst_metadata(self, name, metadata):
-        if not DDB.at("Analysts").exists():
-            DDB.at("Analysts").create({})
-        if not DDB.at("Analysts", key=name).exists():
+        if not self.storage.at("Analysts").exists():
+            self.storage.at("Analysts").create({})
+        if not self.storage.at("Analysts", key=name).exists():
             raise ValueError(f"Analyst {name} not found")
-        with DDB.at("Analysts").session() as (session, analysts):
+        with self.storage.at("Analysts").session() as (session, analysts):
             analysts[name].update(metadata)
             session.write()
         return True
 
-    @log_update
+    @log_update("analysts")
+    def save_collection_job(self, analyst_name, job):
+        """ Stores a data collection job of the analyst under its key, replacing an earlier state of it """
+        if not self.storage.at("Analysts", key=analyst_name).exists():
+            raise ValueError(f"Analyst {analyst_name} not found")
+        with self.storage.at("Analysts").session() as (session, analysts):
+            analysts[analyst_name].setdefault("collections", {})[job["key"]] = job
+            session.write()
+        return True
+
+    def get_collection_jobs(self, analyst_name, status=None):
+        """ Returns the analyst's data collection jobs, only those with this status if given """
+        jobs = self.get_analyst_metadata(analyst_name).get("collections", {})
+        return [job for job in jobs.values() if status is None or job["status"] == status]
+
+    def get_extractions(self, paper_id):
+        """ Returns the cached extraction results of a paper, {extraction key: entry} """
+        return self.storage.at("extractions/" + paper_id, table="extractions").read() or {}
+
+    @log_update()
+    def store_extraction(self, paper_id, key, entry):
+        name = "extractions/" + paper_id
+        if not self.storage.at(name, table="extractions").exists():
+            self.storage.at(name, table="extractions").create({})
+        with self.storage.at(name, table="extractions").session() as (session, extractions):
+            extractions[key] = entry
+            session.write()
+        return True
+
     def add_paper_to_list(self, paper_id, analyst, name_of_list):
-        if not DDB.at("papers", key=paper_id).exists():
-            raise ValueError(f"Paper with id {paper_id} not found")
-        if not DDB.at("Analysts").exists():
-            DDB.at("Analysts").create({})
-        if not DDB.at("Analysts", key=analyst).exists():
+        return self.add_papers_to_list([paper_id], analyst, name_of_list)
+
+    @log_update("papers")
+    def add_papers_to_list(self, paper_ids, analyst, name_of_list):
+        if not self.storage.at("Analysts").exists():
+            self.storage.at("Analysts").create({})
+        if not self.storage.at("Analysts", key=analyst).exists():
             raise ValueError(f"Analyst {analyst} not found")
-        with DDB.at("papers").session() as (session, papers):
-            if analyst not in papers[paper_id]:
-                papers[paper_id][analyst] = [name_of_list]
-            else:
-                if name_of_list not in papers[paper_id][analyst]:
-                    papers[paper_id][analyst].append(name_of_list)
+        if not paper_ids:
+            return True
+        with self.storage.at("papers").session() as (session, papers):
+            for paper_id in paper_ids:
+                if paper_id not in papers:
+                    raise ValueError(f"Paper with id {paper_id} not found")
+            for paper_id in paper_ids:
+                if analyst not in papers[paper_id]:
+                    papers[paper_id][analyst] = [name_of_list]
+                else:
+                    if name_of_list not in papers[paper_id][analyst]:
+                        papers[paper_id][analyst].append(name_of_list)
             session.write()
+        self.papers_changed(*paper_ids)
         return True
 
-    @log_update
+    @log_update("papers")
     def remove_paper_from_list(self, paper_id, analyst, name_of_list=None):
-        if not DDB.at("papers", key=paper_id).exists():
+        if not self.storage.at("papers", key=paper_id).exists():
             raise ValueError(f"Paper with id {paper_id} not found")
-        if not DDB.at("Analysts").exists():
-            DDB.at("Analysts").create({})
-        with DDB.at("papers").session() as (session, papers):
+        if not self.storage.at("Analysts").exists():
+            self.storage.at("Analysts").create({})
+        with self.storage.at("papers").session() as (session, papers):
             if analyst in papers[paper_id]:
                 if name_of_list is None:
                     papers[paper_id][analyst] = []
                 elif name_of_list in papers[paper_id][analyst]:
                     papers[paper_id][analyst].remove(name_of_list)
             session.write()
+        self.papers_changed(paper_id)
         return True
 
     def get_all_tool_trackers_for_analyst(self, analyst_name):
-        analysts = DDB.at("Analysts").read()
+        analysts = self._read("analysts", "Analysts")
         if not analysts:
             return []
         if analyst_name not in analysts:
@@ -478,7 +860,7 @@ class DatabaseManager:
             csv_path = None
             if "csv_path" in tool:
                 csv_path = tool["csv_path"]
-            json_path = os.path.join(self.project_path, "scienceai_ddb", tool["json_path"])
+            json_path = self.storage.file_path(tool["json_path"][:-len(".json")])
             if tool["tool_name"][:-19] not in files:
                 files[tool["tool_name"][:-19]] = json_path
                 tools[json_path] = csv_path
@@ -489,75 +871,97 @@ class DatabaseManager:
         return tools
 
     def get_analyst_tool_tracker(self, json_path):
-        data = DDB.at(json_path).read()
+        data = self.storage.at(json_path, table="trackers").read()
         return data
 
-    @log_update
+    @log_update("analysts")
     def clear_analyst_context(self, name):
-        if not DDB.at(name).exists():
+        if not self.storage.at(name, table="contexts").exists():
             raise ValueError(f"Analyst {name} not found")
-        with DDB.at("Analysts").session() as (session, analysts):
+        with self.storage.at("Analysts").session() as (session, analysts):
             analysts[name]["contexts"] = []
             session.write()
         return True
 
     def get_analyst_metadata(self, name):
-        if not DDB.at("Analysts", key=name).exists():
+        analysts = self._read("analysts", "Analysts") or {}
+        if name not in analysts:
             raise ValueError(f"Analyst {name} not found")
-        with DDB.at("Analysts").session() as (session, analysts):
-            return analysts[name]
+        return dict(analysts[name])
 
     def get_all_analysts(self):
-        if not DDB.at("Analysts").exists():
+        analysts = self._read("analysts", "Analysts")
+        if analysts is None:
             return []
-        else:
-            all = []
-            for name in DDB.at("Analysts").read().keys():
-                temp = self.get_analyst_metadata(name).copy()
-                temp["name"] = name
-                all.append(temp)
-            return all
+        return [{**metadata, "name": name} for name, metadata in analysts.items()]
 
     def get_all_papers(self, analyst=None, named_list=None):
         if (analyst or named_list) and not (analyst and named_list):
             raise ValueError("Both analyst and named_list must be provided")
-        papers = DDB.at("papers").read()
+        papers = self._read("papers", "papers") or {}
         if analyst:
-            result = [paper for paper in papers.values() if analyst in paper and named_list in paper[analyst]]
+            result = [dict(paper) for paper in papers.values() if analyst in paper and named_list in paper[analyst]]
             return result
-        return list(papers.values())
+        return [dict(paper) for paper in papers.values()]
 
-    @log_update
+    @log_update("papers")
     def remove_all_analyst_lists(self, analyst):
-        with DDB.at("papers").session() as (session, papers):
-            for paper_id in papers:
-                self.remove_paper_from_list(paper_id, analyst)
+        if not self.storage.at("papers").exists():
+            return True
+        with self.storage.at("papers").session() as (session, papers):
+            changed = [paper_id for paper_id, paper in papers.items() if paper.get(analyst)]
+            for paper_id in changed:
+                papers[paper_id][analyst] = []
+            session.write()
+        if changed:
+            self.papers_changed(*changed)
         return True
 
-    def get_paper_data(self, paper_id):
-        if not DDB.at("papers", key=paper_id).exists():
+    def get_paper_data(self, paper_id, fields=None):
+        """ Returns the processed paper data with its database record under "database".
+
+        When fields is given only those fields are returned. Fields in INDEXED_FIELDS are served from the
+        paper index without opening the full paper file.
+        """
+        if not self.storage.at("papers", key=paper_id).exists():
             raise ValueError(f"Paper with id {paper_id} not found")
-        paper = DDB.at("papers", key=paper_id).read()
-        data = {}
-        if DDB.at(paper_id).exists():
-            data = DDB.at(paper_id).read()
+        paper = self.storage.at("papers", key=paper_id).read()
+        index_entry = None
+        if fields and all(field in INDEXED_FIELDS for field in fields) and self.storage.at("paper_index").exists():
+            index_entry = self.storage.at("paper_index", key=paper_id).read()
+        return self._project_paper_data(paper, fields, index_entry)
+
+    def _project_paper_data(self, paper, fields, index_entry):
+        paper_id = paper["paper_id"]
+        if index_entry is not None and fields and all(field in INDEXED_FIELDS for field in fields):
+            data = {field: index_entry.get(field) for field in fields}
+        else:
+            data = self._index_source(paper_id, paper)
+            if fields:
+                derived = build_index_entry(data) if any(field in INDEXED_FIELDS for field in fields) else {}
+                data = {field: data[field] if field in data else derived.get(field) for field in fields}
         data["database"] = paper
         return data
 
-    def get_all_papers_data(self, analyst=None, named_list=None, selected_key=None):
+    def get_all_papers_data(self, analyst=None, named_list=None, selected_key=None, fields=None):
+        """ Returns get_paper_data for every paper (in a list if given) or just the selected_key of each """
         papers = self.get_all_papers(analyst=analyst, named_list=named_list)
+        if selected_key:
+            fields = [selected_key]
+        index = {}
+        if fields and all(field in INDEXED_FIELDS for field in fields) and self.storage.at("paper_index").exists():
+            index = self.storage.at("paper_index").read()
         output = []
         for paper in papers:
-            paper_id = paper["paper_id"]
-            paper_data = self.get_paper_data(paper_id)
+            paper_data = self._project_paper_data(paper, fields, index.get(paper["paper_id"]))
             if selected_key:
-                paper_data = paper_data.get(selected_key)
+                output.append(paper_data.get(selected_key))
             else:
                 output.append(paper_data)
         return output
 
     def get_analyst_data_visual(self, path):
-        analysts = DDB.at("Analysts").read()
+        analysts = self._read("analysts", "Analysts")
         if not analysts:
             return {}
         else:
@@ -567,7 +971,7 @@ class DatabaseManager:
         path_parts = path.strip("/").split("/")
         if len(path_parts) == 1:
             add_ons = {"evidence_files": {}, "internal_memory": {}}
-            analyst = DDB.at(path_parts[0]).read()
+            analyst = dict(self._read("analysts", path_parts[0], table="contexts") or {})
             analyst.update(add_ons)
             return analyst
         if len(path_parts) == 2:
@@ -578,6 +982,8 @@ class DatabaseManager:
             metadata["internal_memory"] = {}
             if "tools" in metadata:
                 del metadata["tools"]
+            if "collections" in metadata:
+                del metadata["collections"]
             return metadata
         if len(path_parts) > 2 and path_parts[2] == "evidence_files":
             results = self.get_all_tool_trackers_for_analyst(path_parts[1])
@@ -602,32 +1008,72 @@ class DatabaseManager:
                     result = result[part] if isinstance(result, dict) else result[int(part)]
                 return result if isinstance(result, dict) else {str(i): v for i, v in enumerate(result)}
 
+    def _database_paper(self, paper):
+        if "Title" in paper:
+            return {**paper, **{"json_path": self.storage.file_path(paper["paper_id"])}}
+        return dict(paper)
+
     def get_database_papers(self):
-        full = DDB.at("papers").read()
+        full = self._read("papers", "papers")
         if not full:
             return []
-        return [{**paper, **{"json_path": os.path.join(self.project_path, "scienceai_ddb", paper["paper_id"] + ".json")}} if "Title" in paper else paper for paper in full.values()]
+        return [self._database_paper(paper) for paper in full.values()]
+
+    def get_papers_since(self, version=0):
+        """
+        Cursor read of the papers list. Returns (version, papers, removed, complete): the papers added or changed
+        after version, the ids of papers removed since then, and whether papers is the full list because the
+        version was 0 or not one this project has reached. Pass the returned version to the next call.
+        """
+        versions = self._read("papers", "paper_versions") or {}
+        current = max(versions.values(), default=0)
+        if version <= 0 or version > current:
+            return current, self.get_database_papers(), [], True
+        papers = []
+        removed = []
+        changed = sorted((paper_id for paper_id, paper_version in versions.items() if paper_version > version),
+                         key=versions.get)
+        for paper_id in changed:
+            if self.storage.at("papers", key=paper_id).exists():
+                papers.append(self._database_paper(self.storage.at("papers", key=paper_id).read()))
+            else:
+                removed.append(paper_id)
+        return current, papers, removed, False
+
+    def _read_log(self, log_name, legacy_name, legacy_key, legacy_table):
+        """ Reads an append only log, falling back to the list it replaces until the writer has migrated it """
+        records = self.storage.log(log_name).read()
+        if not records and self.storage.at(legacy_name, table=legacy_table).exists():
+            records = self.storage.at(legacy_name, key=legacy_key, table=legacy_table).read() or []
+        return records
 
     def get_database_chat(self):
-        full = DDB.at("chat", key="messages").read()
-        if not full:
-            return []
-        return full
+        return self._read_log("chat", "chat", "messages", "chat")
+
+    def get_chat_since(self, version=0):
+        """
+        Cursor read of the chat. Returns (version, messages, complete) where messages are the (index, message)
+        pairs added or updated after version, every message when complete is True.
+        """
+        version, changes, complete = self.storage.log("chat").read_since(version)
+        if version == 0 and self.storage.at("chat", key="messages").exists():
+            # the writer has not moved the chat into its log yet, so every read is a full one until it does
+            return 0, list(enumerate(self.storage.at("chat", key="messages").read() or [])), True
+        return version, changes, complete
 
     def get_last_message(self):
-        if not DDB.at("chat", key="messages").exists():
-            return None
-        full = DDB.at("chat", key="messages").read()
+        full = self.get_database_chat()
         if len(full) == 0:
             return None
         return full[-1]
 
     def get_analyst_context(self, name, include_hidden=False):
-        if not DDB.at(name).exists():
+        if not self.storage.at(name, table="contexts").exists():
             raise ValueError(f"Analyst {name} not found")
+        context = self._read_log("contexts/" + name, name, "context", "contexts")
         if include_hidden:
-            return DDB.at(name).read()["context"]
-        return [context for context in DDB.at(name).read()["context"] if not context.get("hidden", False)]
+            return context
+        return [message for message in context if not message.get("hidden", False)]
 
     def get_last_save(self, path=False):
         existing_save = None
@@ -640,8 +1086,12 @@ class DatabaseManager:
         return existing_save
 
     def save_database(self):
-        existing_save = self.get_last_save(path=True)
-        new_save = self.project_name + "_-checkpoint-_" + self.update_time.replace(" ", "_").replace(":", "_")
-        shutil.copytree(self.project_path, os.path.join(self.storage_path, new_save))
-        if existing_save:
-            shutil.rmtree(existing_save)
\ No newline at end of file
+        self.storage.checkpoint()
+        with self.checkpoint_store.lock():
+            existing_save = self.get_last_save(path=True)
+            new_save = self.project_name + "_-checkpoint-_" + self.update_time.replace(" ", "_").replace(":", "_")
+            new_save_path = os.path.join(self.storage_path, new_save)
+            self.checkpoint_store.snapshot(self.project_path, new_save_path,
+                                          previous=os.path.basename(existing_save) if existing_save else None)
+            if existing_save and existing_save != new_save_path:
+                self.checkpoint_store.delete(existing_save)
\ No newline at end of file
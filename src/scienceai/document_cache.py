@@ -0,0 +1,48 @@
+import threading
+from collections import OrderedDict
+
+
+DOCUMENT_CACHE_SIZE = 256
+
+
+class DocumentCache:
+    """
+    Bounded least recently used cache of parsed documents. Each entry is stored with the change feed version
+    of the collection it belongs to and is only served while that version is current, so a write logged to
+    the feed, by this process or, for readers watching the feed's files, by another one, invalidates it.
+    Cached documents are shared between callers and must not be mutated.
+    """
+    def __init__(self, max_entries=DOCUMENT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key, version):
+        """ Returns (True, document) for a current entry, (False, None) otherwise """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, entry[1]
+
+    def put(self, key, version, document):
+        with self._lock:
+            self._entries[key] = (version, document)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries),
+                    "hit_rate": self.hits / lookups if lookups else 0.0}
@@ -1,17 +1,270 @@
-from openai import OpenAI
+from openai import OpenAI, RateLimitError
+from openai.types.chat import ChatCompletion
+from concurrent.futures import Future, ThreadPoolExecutor
+import asyncio
+import hashlib
 import tiktoken
 import json
+import multiprocessing
 import os
 import threading
 import traceback
+from .rate_budget import RateBudget
+
+
+DEFAULT_REQUESTS_PER_MINUTE = 500
+DEFAULT_TOKENS_PER_MINUTE = 300000
+DEFAULT_MAX_CONCURRENT_REQUESTS = 16
+IMAGE_TOKEN_ESTIMATE = 1105
+COMPLETION_TOKEN_ESTIMATE = 1000
+DEFAULT_CACHE_MAX_BYTES = 512 * 1024 * 1024
+CACHE_SCAN_INTERVAL = 64
+
+
+class RateLimitScheduler:
+    """
+    Runs chat completion requests on a shared worker pool while keeping the requests-per-minute and
+    tokens-per-minute budgets over a sliding one minute window. A 429 from the API pauses every
+    submission (honouring Retry-After when present) with an exponential backoff that resets on success.
+    The budget is a RateBudget, which use_budget can swap for one shared with other processes.
+    """
+    def __init__(self, requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE, tokens_per_minute=DEFAULT_TOKENS_PER_MINUTE,
+                 max_workers=DEFAULT_MAX_CONCURRENT_REQUESTS, max_retries=6):
+        self.max_retries = max_retries
+        self.budget = RateBudget(requests_per_minute, tokens_per_minute)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="scienceai-llm")
+        self._condition = threading.Condition()
+
+    def configure(self, requests_per_minute=None, tokens_per_minute=None, max_workers=None):
+        self.budget.configure(requests_per_minute=requests_per_minute, tokens_per_minute=tokens_per_minute)
+        with self._condition:
+            self._condition.notify_all()
+        if max_workers:
+            old_executor = self._executor
+            self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="scienceai-llm")
+            old_executor.shutdown(wait=False)
+
+    def use_budget(self, budget):
+        self.budget = budget
+        with self._condition:
+            self._condition.notify_all()
+
+    def _acquire(self, tokens):
+        while True:
+            entry_id, wait = self.budget.reserve(tokens)
+            if entry_id is not None:
+                return entry_id
+            # a shared budget can free up from another process without waking this one, so waits are capped
+            with self._condition:
+                self._condition.wait(min(wait, 1))
+
+    def _settle(self, entry_id, actual_tokens):
+        self.budget.settle(entry_id, actual_tokens)
+        with self._condition:
+            self._condition.notify_all()
+
+    def _rate_limited(self, error):
+        retry_after = 0
+        try:
+            retry_after = float(error.response.headers.get("retry-after", 0))
+        except Exception:
+            pass
+        delay = self.budget.rate_limited(retry_after)
+        print(f"Rate limited, pausing requests for {delay:.1f} seconds")
+
+    def _run(self, create, arguments, check_stop):
+        tokens = estimate_tokens(arguments)
+        for attempt in range(self.max_retries + 1):
+            check_stop()
+            entry = self._acquire(tokens)
+            try:
+                response = create(**arguments)
+            except RateLimitError as e:
+                self._settle(entry, tokens)
+                if attempt == self.max_retries:
+                    print(f"Request failed: {e}")
+                    return None
+                self._rate_limited(e)
+                continue
+            except Exception as e:
+                self._settle(entry, tokens)
+                print(f"Request failed: {e}")
+                return None
+            usage = getattr(response, "usage", None)
+            self._settle(entry, usage.total_tokens if usage else tokens)
+            self.budget.succeeded()
+            return response
+        return None
+
+    def submit(self, create, arguments, check_stop):
+        return self._executor.submit(self._run, create, arguments, check_stop)
+
+
+def estimate_tokens(arguments):
+    """
+    Estimate the tokens a chat completion request will consume, including the expected completion.
+    :param arguments:
+    :type arguments: dict
+    :return: estimated token count
+    :rtype: int
+    """
+    tokens = 0
+    for message in arguments.get("messages", []):
+        tokens += 4
+        content = message.get("content")
+        if isinstance(content, str):
+            tokens += len(enc.encode(content, disallowed_special=()))
+        elif isinstance(content, list):
+            for part in content:
+                if part.get("type") == "text":
+                    tokens += len(enc.encode(part["text"], disallowed_special=()))
+                elif part.get("type") == "image_url":
+                    tokens += IMAGE_TOKEN_ESTIMATE
+    if arguments.get("tools"):
+        tokens += len(enc.encode(json.dumps(arguments["tools"]), disallowed_special=()))
+    return tokens + (arguments.get("max_tokens") or COMPLETION_TOKEN_ESTIMATE)
+
+
+class ResponseCache:
+    """
+    Disk backed cache of chat completion responses keyed by a canonical hash of the request arguments.
+    The cache folder is the index: a hit refreshes the file's mtime, and once the folder grows past max_bytes
+    the files with the oldest mtimes are removed. Every process using the folder, such as the backend and the
+    web app, therefore shares one least recently used order and sees the others' entries.
+    """
+    def __init__(self, cache_dir, max_bytes=DEFAULT_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._puts = 0
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        self._size = self._evict()
+
+    @staticmethod
+    def make_key(arguments):
+        canonical = json.dumps(arguments, sort_keys=True, separators=(",", ":"), default=str)
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + ".json")
+
+    def _evict(self):
+        """ Removes the least recently used files until the folder fits in max_bytes, returns its size """
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".json"):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        size = sum(entry[1] for entry in entries)
+        for mtime, file_size, path in sorted(entries)[:-1]:
+            if size <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size -= file_size
+        return size
+
+    def get(self, key):
+        try:
+            with open(self._path(key), "r") as file:
+                response = ChatCompletion.model_validate_json(file.read())
+            os.utime(self._path(key))
+        except Exception:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return response
+
+    def put(self, key, response):
+        data = response.model_dump_json()
+        temp_path = self._path(key) + "." + str(os.getpid()) + "." + str(threading.get_ident()) + ".tmp"
+        with open(temp_path, "w") as file:
+            file.write(data)
+        os.replace(temp_path, self._path(key))
+        with self._lock:
+            self._size += len(data)
+            self._puts += 1
+            # other processes add files too, so the folder is also measured every CACHE_SCAN_INTERVAL writes
+            if self._size > self.max_bytes or self._puts % CACHE_SCAN_INTERVAL == 0:
+                self._size = self._evict()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0,
+                    "bytes": self._size}
+
+
+class ScheduledCompletions:
+    def __init__(self, wrapper):
+        self._wrapper = wrapper
+
+    def submit(self, cache=False, **kwargs):
+        """
+        Queue a chat completion and return a concurrent.futures.Future resolving to the response.
+        Pass cache=True for deterministic calls to serve and store the response in the response cache. Only
+        requests made with temperature 0 are cached, a sampled answer must not be replayed.
+        """
+        self._wrapper._check_stop()
+        response_cache = self._wrapper._response_cache
+        if not cache or response_cache is None or kwargs.get("temperature") != 0:
+            return self._wrapper._scheduler.submit(self._wrapper._client.chat.completions.create, kwargs,
+                                                   self._wrapper._check_stop)
+        key = response_cache.make_key(kwargs)
+        cached = response_cache.get(key)
+        if cached is not None:
+            future = Future()
+            future.set_result(cached)
+            return future
+        future = self._wrapper._scheduler.submit(self._wrapper._client.chat.completions.create, kwargs,
+                                                 self._wrapper._check_stop)
+
+        def store(done):
+            if not done.cancelled() and done.exception() is None and done.result() is not None:
+                try:
+                    response_cache.put(key, done.result())
+                except Exception as e:
+                    print(f"Failed to cache response: {e}")
+        future.add_done_callback(store)
+        return future
+
+    def create(self, **kwargs):
+        return self.submit(**kwargs).result()
+
+    async def acreate(self, **kwargs):
+        return await asyncio.wrap_future(self.submit(**kwargs))
+
+
+class ScheduledChat:
+    def __init__(self, wrapper):
+        self.completions = ScheduledCompletions(wrapper)
 
 
 class GenericClientWrapper:
-    def __init__(self, client, stop_event):
+    def __init__(self, client, stop_event, scheduler=None, response_cache=None):
         self._client = client
         self._stop_event = stop_event
+        self._scheduler = scheduler
+        self._response_cache = response_cache
+
+    def _check_stop(self):
+        if self._stop_event.is_set():
+            quit(0)
 
     def __getattr__(self, name):
+        if name == "chat" and self._scheduler is not None:
+            self._check_stop()
+            return ScheduledChat(self)
         attr = getattr(self._client, name)
         if self._stop_event.is_set():
             quit(0)
@@ -30,7 +283,10 @@ class GenericClientWrapper:
 
 base_key_path = os.path.join(os.path.expanduser("~"), "Documents", "ScienceAI")
 target_key = os.path.join(base_key_path, "scienceai-keys.json")
-if not os.path.exists(target_key):
+# spawned children such as the backend and the rate budget manager import this module too; they have no stdin,
+# so they never prompt for or test the key and are handed it by the process that started them (use_api_key)
+in_child_process = multiprocessing.parent_process() is not None
+if not os.path.exists(target_key) and not in_child_process:
     new_key = input("Please enter OpenAI key: ")
     if not os.path.exists(os.path.dirname(os.path.dirname(target_key))):
         os.mkdir(os.path.dirname(os.path.dirname(target_key)))
@@ -38,44 +294,80 @@ if not os.path.exists(target_key):
         os.mkdir(os.path.dirname(target_key))
     with open(target_key, "w") as file:
         json.dump({"openai": new_key}, file)
-with open(target_key, "r") as file:
-    key_list = json.load(file)
+key_list = {}
+if os.path.exists(target_key):
+    with open(target_key, "r") as file:
+        key_list = json.load(file)
 openai_key = key_list.get("openai")
-if openai_key is None:
+if in_child_process:
+    __client = OpenAI(api_key=openai_key) if openai_key else None
+elif openai_key is None:
     raise Exception("Open AI key not in scienceai-keys.json")
+else:
+    try:
+        __client = OpenAI(api_key=openai_key)
 
-try:
-    __client = OpenAI(api_key=openai_key)
 
+        def is_api_key_valid():
+            response = __client.chat.completions.create(model="gpt-4o",
+                                                          messages=[{"role": "user", "content": "Hello, "}],
+                                                          max_tokens=1)
 
-    def is_api_key_valid():
-        response = __client.chat.completions.create(model="gpt-4o", messages=[{"role": "user", "content": "Hello, "}],
-                                                      max_tokens=1)
 
-
-    is_api_key_valid()
-except Exception as e:
-    delete = input("Error creating OpenAI client - delete saved key? (Y/n): ")
-    if delete.lower() == "y":
-        os.remove(target_key)
-        new_key = input("Please enter OpenAI key: ")
-        with open(target_key, "w") as file:
-            json.dump({"openai": new_key}, file)
-        __client = OpenAI(api_key=new_key)
-    else:
-        raise e
+        is_api_key_valid()
+    except Exception as e:
+        delete = input("Error creating OpenAI client - delete saved key? (Y/n): ")
+        if delete.lower() == "y":
+            os.remove(target_key)
+            new_key = input("Please enter OpenAI key: ")
+            with open(target_key, "w") as file:
+                json.dump({"openai": new_key}, file)
+            openai_key = new_key
+            __client = OpenAI(api_key=new_key)
+        else:
+            raise e
 
 enc = tiktoken.encoding_for_model("gpt-4")
 
 stop_event = threading.Event()
 
-client = GenericClientWrapper(__client, stop_event)
+rate_limits = key_list.get("rate_limits", {})
+scheduler = RateLimitScheduler(
+    requests_per_minute=rate_limits.get("requests_per_minute", DEFAULT_REQUESTS_PER_MINUTE),
+    tokens_per_minute=rate_limits.get("tokens_per_minute", DEFAULT_TOKENS_PER_MINUTE),
+    max_workers=rate_limits.get("max_concurrent_requests", DEFAULT_MAX_CONCURRENT_REQUESTS))
+
+response_cache = ResponseCache(os.path.join(base_key_path, "llm_cache"),
+                               max_bytes=key_list.get("response_cache_max_bytes", DEFAULT_CACHE_MAX_BYTES))
+
+client = GenericClientWrapper(__client, stop_event, scheduler=scheduler, response_cache=response_cache)
 
 
 def update_stop_event(event):
     client._stop_event = event
 
 
+def use_api_key(api_key):
+    """
+    Points the client at this OpenAI key, how a spawned backend gets the key the web app validated.
+    :param api_key:
+    :type api_key: str
+    """
+    global openai_key
+    openai_key = api_key
+    client._client = OpenAI(api_key=api_key)
+
+
+def use_rate_budget(budget):
+    """
+    Makes every request from this process draw from budget, such as a RateBudget proxy shared by the
+    backends of several projects.
+    :param budget:
+    :type budget: RateBudget
+    """
+    scheduler.use_budget(budget)
+
+
 def check_tool(function_name, parameters, tools):
     function_names = []
     for tool in tools:
@@ -0,0 +1,105 @@
+import base64
+import shutil
+import string
+
+import fitz
+from math import atan2, degrees
+
+
+# Kept free of the llm import so rendering can run in worker processes without creating an OpenAI client
+
+# a page's text layer is trusted when it has at least this many characters per square point (~400 on a letter page)
+MIN_CHAR_DENSITY = 0.0008
+# and at least this share of its characters are letters, digits, whitespace or punctuation
+MIN_GOOD_GLYPH_RATIO = 0.9
+# pages with more vector drawings than this are assumed to hold a chart or ruled table
+FIGURE_DRAWING_THRESHOLD = 40
+
+
+def rotate_pdf_pages(pdf_path):
+    doc = fitz.open(pdf_path)
+    for page in doc:
+        text_blocks = page.get_text("dict")["blocks"]
+        total_weight = 0
+        weighted_sum_angles = 0
+
+        # Collect angles of text blocks
+        for block in text_blocks:
+            if block["type"] == 0:  # Text block
+                for line in block['lines']:
+                    dir_vector = line['dir']
+                    for span in line['spans']:
+                        angle = atan2(dir_vector[1], dir_vector[0])
+                        text_length = len(span['text'])
+                        weighted_sum_angles += degrees(angle) * text_length
+                        total_weight += text_length
+
+        weighted_average_angle = weighted_sum_angles / total_weight if total_weight else 0
+
+        # Calculate the average angle if angles were detected
+        if total_weight > 0:
+            average_angle = weighted_average_angle
+
+            # Determine the rotation needed to align text upright
+            # We assume that text should be as close to 0 degrees as possible
+            # This might need adjustments for specific use cases
+            if average_angle != 0:
+                # Normalize the average angle to the nearest multiple of 90
+                # This is a simplistic approach; more sophisticated logic may be needed
+                normalized_angle = 360 - (round(average_angle / 90) * 90)
+                page.set_rotation(normalized_angle)
+    modified_pdf_path = pdf_path.replace(".pdf", "_rotated.pdf")
+    doc.save(modified_pdf_path)
+    doc.close()
+    shutil.move(modified_pdf_path, pdf_path)
+    return
+
+
+def extract_page_text(page):
+    blocks = page.get_text("blocks", sort=True)
+    return "\n\n".join(block[4].strip() for block in blocks if block[6] == 0 and block[4].strip())
+
+
+def is_text_layer_usable(page, text):
+    """ Scanned pages have little or no text and garbled text layers are full of unmapped glyphs. """
+    if not text or len(text) / abs(page.rect) < MIN_CHAR_DENSITY:
+        return False
+    good = sum(1 for c in text if c.isalnum() or c.isspace() or c in string.punctuation)
+    return good / len(text) >= MIN_GOOD_GLYPH_RATIO
+
+
+def page_has_figures(page):
+    if page.get_images():
+        return True
+    try:
+        if page.find_tables().tables:
+            return True
+    except Exception:
+        pass
+    return len(page.get_drawings()) > FIGURE_DRAWING_THRESHOLD
+
+
+def render_pdf_pages(pdf_path, text_layer=False):
+    """
+    Render every page to a PNG data URL. With text_layer set, the second list holds the extracted text
+    and a figure flag for each page whose text layer can be trusted and None for pages that need vision.
+    """
+    rotate_pdf_pages(pdf_path)
+    doc = fitz.open(pdf_path)
+    # use fitz to create a clear image of each page make sure to use a high DPI
+    page_images = []
+    page_text_layers = []
+    for i in range(len(doc)):
+        page = doc[i]
+        mat = fitz.Matrix(200 / 72, 200 / 72)
+        image = page.get_pixmap(matrix=mat)
+        base64_image = base64.b64encode(image.tobytes()).decode("utf-8")
+        page_images.append("data:image/png;base64," + base64_image)
+        layer = None
+        if text_layer:
+            text = extract_page_text(page)
+            if is_text_layer_usable(page, text):
+                layer = {"text": text, "has_figures": page_has_figures(page)}
+        page_text_layers.append(layer)
+    doc.close()
+    return page_images, page_text_layers
@@ -13,8 +13,9 @@ with open(os.path.join(path_to_app, "principle_investigator_base_prompt.txt"), "
 
 # PI Module
 class PrincipalInvestigator:
-    def __init__(self, dbr: DatabaseManager):
+    def __init__(self, dbr: DatabaseManager, progress_callback=None):
         self.db = dbr
+        self.progress_callback = progress_callback
         self.analysts = []
         analysts_db = dbr.get_all_analysts()
         for analyst_dict in analysts_db:
@@ -36,7 +37,7 @@ class PrincipalInvestigator:
             if last_chat["content"] == first_message:
                 self.db.update_last_chat("Pending")
                 self.db.ingest_papers()
-                self.db.process_all_papers()
+                self.db.process_all_papers(progress_callback=self.report_ingest_progress)
                 self.db.update_last_chat("Processed")
                 second = {"content": second_message, "role": "system", "status": "Pending",
                           "time": datetime.now().strftime('%B %d, %Y %I:%M:%S %p %Z')}
@@ -56,7 +57,7 @@ class PrincipalInvestigator:
                      "time": datetime.now().strftime('%B %d, %Y %I:%M:%S %p %Z')}
             self.db.add_chat(first)
             self.db.ingest_papers()
-            self.db.process_all_papers()
+            self.db.process_all_papers(progress_callback=self.report_ingest_progress)
             self.db.update_last_chat("Processed")
             second = {"content": second_message, "role": "system", "status": "Pending",
                       "time": datetime.now().strftime('%B %d, %Y %I:%M:%S %p %Z')}
@@ -64,6 +65,14 @@ class PrincipalInvestigator:
             self.db.update_last_chat("Processed")
         self.db.update_last_chat("Processed")
 
+    def report_ingest_progress(self, completed, total, paper_id, error):
+        progress = f"{completed} of {total} papers processed"
+        if error:
+            progress += f" (failed to process {paper_id[:10]})"
+        self.db.update_last_chat("Pending", progress=progress)
+        if self.progress_callback:
+            self.progress_callback(completed=completed, total=total, paper_id=paper_id, error=error)
+
     def delegate_research(self, name, question, return_tool=False):
         if return_tool:
             return {
@@ -174,6 +183,9 @@ class PrincipalInvestigator:
         self.db.update_last_chat("Processed")
 
     def finish_tool_calls(self, last_chat):
+        # collections the analysts were running are finished from their trackers rather than started over
+        for analyst in self.analysts:
+            analyst.resume_collections()
         new_history = use_tools(last_chat, {"messages": self.db.get_database_chat(), "model": "gpt-4o",
                                             "tools": self.tools, "temperature": 0.2}, function_dict=self.tool_callables)
         for call in new_history:
@@ -1,17 +1,15 @@
-import base64
-import os
-import tempfile
-import shutil
-
-import fitz
-from math import atan2, degrees
+from concurrent.futures import ThreadPoolExecutor
 
 from .llm import client, use_tools
+from .pdf_pages import render_pdf_pages, rotate_pdf_pages
 from pprint import pprint as print
 
 from habanero import Crossref
 cr = Crossref()
 
+PAGE_WORKERS = 4
+USE_TEXT_LAYER = True
+
 
 def summarize_paper(text):
     system_message = ("Given a block of text, your task is to summarize the text into a concise paragraph. "
@@ -106,14 +104,14 @@ def extract_doi(images, incorrect_doi_list=None):
             }
         ]
 
-        arguments = {"messages": messages, "tools": tools, "model": "gpt-4o"}
+        arguments = {"messages": messages, "tools": tools, "model": "gpt-4o", "temperature": 0}
 
         retry = 0
         valid_calls = []
         while valid_calls == [] and retry < 5 :
             if retry > 0:
                 print("Retrying...")
-            chat_response = client.chat.completions.create(**arguments)
+            chat_response = client.chat.completions.create(**arguments, cache=retry == 0)
             if chat_response.choices[0].message.tool_calls:
                 valid_calls = use_tools(chat_response, arguments, call_functions=False)
                 if valid_calls:
@@ -124,7 +122,7 @@ def extract_doi(images, incorrect_doi_list=None):
     return None
 
 
-def create_cleaned_text(images):
+def create_cleaned_text(images, max_workers=PAGE_WORKERS, text_layers=None):
 
     figure_present_system_message = ("Read the contents of the provided scan of a page from a research paper. "
                                      "Record the number of figures and tables that are present on the page.")
@@ -175,44 +173,11 @@ def create_cleaned_text(images):
                                  "introductory text as well as the main body of the paper. Once you have written out "
                                  "the text in the main body of the paper write **PAGE_COMPLETE** and stop.")
 
-    cleaned_text = ""
-
-    for i, image in enumerate(images):
-        print("Processing page " + str(i + 1))
-
-        cleaned_text += "\n\n**Start of Page " + str(i + 1) + "**\n\n"
-
-        messages = [
-            {
-                "role": "system",
-                "content": body_system_message
-            },
-            {
-                "role": "user",
-                "content": [
-                            {
-                              "type": "image_url",
-                              "image_url": {
-                                  "url": image,
-                              }
-                            }
-                          ]
-            }
-        ]
-
-        if i == 0:
-            messages[0]["content"] = first_page_system_message
-
-        arguments = {"messages": messages, "model": "gpt-4o", "temperature": 0.2}
-
-        chat_response = client.chat.completions.create(**arguments)
-
-        cleaned_text += chat_response.choices[0].message.content.replace("**PAGE_COMPLETE**", "")
-
-        messages = [
+    def page_messages(system_message, image):
+        return [
             {
                 "role": "system",
-                "content": figure_present_system_message
+                "content": system_message
             },
             {
                 "role": "user",
@@ -227,7 +192,9 @@ def create_cleaned_text(images):
             }
         ]
 
-        arguments = {"messages": messages, "tools": figure_present_tools, "model": "gpt-4o", "temperature": 0.2,
+    def count_figures_and_tables(image):
+        arguments = {"messages": page_messages(figure_present_system_message, image), "tools": figure_present_tools,
+                     "model": "gpt-4o", "temperature": 0,
                      "tool_choice": {"type": "function", "function": {"name": "store_figure_table_count"}}}
 
         retry = 0
@@ -235,7 +202,7 @@ def create_cleaned_text(images):
         while table_figure_count < 0 and retry < 3:
             if retry > 0:
                 print("Retrying...")
-            chat_response = client.chat.completions.create(**arguments)
+            chat_response = client.chat.completions.create(**arguments, cache=retry == 0)
             if chat_response.choices[0].message.tool_calls:
                 valid_calls = use_tools(chat_response, arguments, call_functions=False)
                 if valid_calls:
@@ -247,35 +214,47 @@ def create_cleaned_text(images):
                             except Exception as e:
                                 table_figure_count = -1
             retry += 1
+        return table_figure_count
 
-        if table_figure_count < 0 or table_figure_count > 0:
-            messages = [
-                {
-                    "role": "system",
-                    "content": figure_system_message
-                },
-                {
-                    "role": "user",
-                    "content": [
-                                {
-                                  "type": "image_url",
-                                  "image_url": {
-                                      "url": image,
-                                  }
-                                }
-                              ]
-                }
-            ]
+    def process_page(i, image):
+        print("Processing page " + str(i + 1))
 
-            arguments = {"messages": messages, "model": "gpt-4o", "temperature": 0.2}
+        text_layer = text_layers[i] if text_layers else None
 
-            chat_response = client.chat.completions.create(**arguments)
+        body_future = None
+        if not text_layer:
+            if i == 0:
+                body_messages = page_messages(first_page_system_message, image)
+            else:
+                body_messages = page_messages(body_system_message, image)
+            # the body transcription runs while this thread counts and describes the figures on the same page
+            body_future = client.chat.completions.submit(messages=body_messages, model="gpt-4o", temperature=0.2)
 
-            cleaned_text += chat_response.choices[0].message.content.replace("**FIGURES_AND_TABLES_COMPLETE**", "")
+        if text_layer and not text_layer["has_figures"]:
+            table_figure_count = 0
+        else:
+            table_figure_count = count_figures_and_tables(image)
 
-        cleaned_text += "\n\n**End of Page " + str(i + 1) + "**\n\n"
+        figure_future = None
+        if table_figure_count < 0 or table_figure_count > 0:
+            figure_future = client.chat.completions.submit(messages=page_messages(figure_system_message, image),
+                                                           model="gpt-4o", temperature=0.2)
 
-    return cleaned_text
+        page_text = "\n\n**Start of Page " + str(i + 1) + "**\n\n"
+        if body_future:
+            page_text += body_future.result().choices[0].message.content.replace("**PAGE_COMPLETE**", "")
+        else:
+            page_text += text_layer["text"]
+        if figure_future:
+            page_text += figure_future.result().choices[0].message.content.replace("**FIGURES_AND_TABLES_COMPLETE**",
+                                                                                   "")
+        page_text += "\n\n**End of Page " + str(i + 1) + "**\n\n"
+        return page_text
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        cleaned_pages = list(executor.map(process_page, range(len(images)), images))
+
+    return "".join(cleaned_pages)
 
 
 def confirm_doi(title, images):
@@ -316,13 +295,13 @@ def confirm_doi(title, images):
                         }
                       ]
         }
-    ], "tools": tools, "model": "gpt-4o", "temperature": 0.2,
+    ], "tools": tools, "model": "gpt-4o", "temperature": 0,
         "tool_choice": {"type": "function", "function": {"name": "store_title"}}}
 
     retry = 0
     title_found = False
     while not title_found and retry < 3:
-        chat_response = client.chat.completions.create(**arguments)
+        chat_response = client.chat.completions.create(**arguments, cache=retry == 0)
         if chat_response.choices[0].message.tool_calls:
             valid_calls = use_tools(chat_response, arguments, call_functions=False)
             if valid_calls:
@@ -359,7 +338,7 @@ def confirm_doi(title, images):
 
     arguments = {"messages": [{"role": "system", "content": system_message},
                               {"role": "user", "content": "Title 1: " + title + "\nTitle 2: " + stored_title}],
-                 "model": "gpt-4o", "temperature": 0.2, "tools": tools,
+                 "model": "gpt-4o", "temperature": 0, "tools": tools,
                  "tool_choice": {"type": "function", "function": {"name": "store_title_similar"}}}
 
     print("Checking title similarity... "
@@ -368,7 +347,7 @@ def confirm_doi(title, images):
     retry = 0
     title_similarity = None
     while title_similarity is None and retry < 3:
-        chat_response = client.chat.completions.create(**arguments)
+        chat_response = client.chat.completions.create(**arguments, cache=retry == 0)
         if chat_response.choices[0].message.tool_calls:
             valid_calls = use_tools(chat_response, arguments, call_functions=False)
             if valid_calls:
@@ -380,45 +359,6 @@ def confirm_doi(title, images):
     return title_similarity
 
 
-def rotate_pdf_pages(pdf_path):
-    doc = fitz.open(pdf_path)
-    for page in doc:
-        text_blocks = page.get_text("dict")["blocks"]
-        total_weight = 0
-        weighted_sum_angles = 0
-
-        # Collect angles of text blocks
-        for block in text_blocks:
-            if block["type"] == 0:  # Text block
-                for line in block['lines']:
-                    dir_vector = line['dir']
-                    for span in line['spans']:
-                        angle = atan2(dir_vector[1], dir_vector[0])
-                        text_length = len(span['text'])
-                        weighted_sum_angles += degrees(angle) * text_length
-                        total_weight += text_length
-
-        weighted_average_angle = weighted_sum_angles / total_weight if total_weight else 0
-
-        # Calculate the average angle if angles were detected
-        if total_weight > 0:
-            average_angle = weighted_average_angle
-
-            # Determine the rotation needed to align text upright
-            # We assume that text should be as close to 0 degrees as possible
-            # This might need adjustments for specific use cases
-            if average_angle != 0:
-                # Normalize the average angle to the nearest multiple of 90
-                # This is a simplistic approach; more sophisticated logic may be needed
-                normalized_angle = 360 - (round(average_angle / 90) * 90)
-                page.set_rotation(normalized_angle)
-    modified_pdf_path = pdf_path.replace(".pdf", "_rotated.pdf")
-    doc.save(modified_pdf_path)
-    doc.close()
-    shutil.move(modified_pdf_path, pdf_path)
-    return
-
-
 def gather_metadata(pages):
     retry = 3
     old_doi_list = None
@@ -482,38 +422,20 @@ def gather_metadata(pages):
     return references, metadata
 
 
-def process_paper(pdf_path):
-    temp_folder = tempfile.mkdtemp()
-    os.makedirs(temp_folder, exist_ok=True)
-    # Open the PDF file
-    rotate_pdf_pages(pdf_path)
-    doc = fitz.open(pdf_path)
-    # use fitz to create a clear image of each page make sure to use a high DPI
-    image_list = []
-    for i in range(len(doc)):
-        page = doc[i]
-        mat = fitz.Matrix(200 / 72, 200 / 72)
-        image = page.get_pixmap(matrix=mat)
-        #image = page.get_pixmap()
-        image_bytes = image.tobytes()
-        image_list.append(image_bytes)
-
-    # # write the first image to a file to test
-    # with open("page0.png", "wb") as f:
-    #     f.write(image_list[0])
-
-    page_images = []
-    for image_bytes in image_list:
-        base64_image = base64.b64encode(image_bytes).decode("utf-8")
-        page_image = "data:image/png;base64," + base64_image
-        page_images.append(page_image)
+def process_paper(pdf_path, render_executor=None, text_layer=USE_TEXT_LAYER):
+    if render_executor:
+        page_images, page_text_layers = render_executor.submit(render_pdf_pages, pdf_path, text_layer).result()
+    else:
+        page_images, page_text_layers = render_pdf_pages(pdf_path, text_layer)
+    vision_pages = sum(1 for layer in page_text_layers if layer is None)
+    print(f"Using the text layer for {len(page_text_layers) - vision_pages} pages and vision for {vision_pages}")
 
     output = {}
     references, metadata = gather_metadata(page_images)
     title = metadata["title"][0]
     output["page_images"] = page_images
-    output["cleaned_text"] = (title + "\n\n\n" +
-                              create_cleaned_text(page_images) + "\n\n## REFERENCES\n" + "\n".join(references))
+    output["cleaned_text"] = (title + "\n\n\n" + create_cleaned_text(page_images, text_layers=page_text_layers) +
+                              "\n\n## REFERENCES\n" + "\n".join(references))
     output["metadata"] = metadata
 
     output["summary"] = summarize_paper(output["cleaned_text"])
@@ -0,0 +1,94 @@
+import itertools
+import multiprocessing
+import random
+import threading
+import time
+from collections import deque
+from multiprocessing.managers import BaseManager
+
+
+class RateBudget:
+    """
+    Requests-per-minute and tokens-per-minute budget over a sliding one minute window, plus the pause that
+    follows a 429. Calls never block, so one budget can be served to several processes by a RateBudgetManager
+    and every project's backend draws from the same limits.
+    """
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._lock = threading.Lock()
+        self._window = deque()
+        self._entries = {}
+        self._window_tokens = 0
+        self._ids = itertools.count()
+        self._pause_until = 0
+        self._backoff = 0
+
+    def configure(self, requests_per_minute=None, tokens_per_minute=None):
+        with self._lock:
+            if requests_per_minute:
+                self.requests_per_minute = requests_per_minute
+            if tokens_per_minute:
+                self.tokens_per_minute = tokens_per_minute
+
+    def _prune(self, now):
+        while self._window and now - self._window[0][1] >= 60:
+            entry_id, started, tokens = self._window.popleft()
+            self._entries.pop(entry_id, None)
+            self._window_tokens -= tokens
+
+    def reserve(self, tokens):
+        """ Takes room for a request of this many tokens, returns (entry id, 0) or (None, seconds to wait) """
+        with self._lock:
+            now = time.time()
+            self._prune(now)
+            if now < self._pause_until:
+                return None, self._pause_until - now
+            fits_requests = len(self._window) < self.requests_per_minute
+            fits_tokens = self._window_tokens + tokens <= self.tokens_per_minute or not self._window
+            if fits_requests and fits_tokens:
+                entry = [next(self._ids), now, tokens]
+                self._window.append(entry)
+                self._entries[entry[0]] = entry
+                self._window_tokens += tokens
+                return entry[0], 0
+            return None, max(60 - (now - self._window[0][1]), 0.05)
+
+    def settle(self, entry_id, actual_tokens):
+        """ Replaces a reservation's estimate with the tokens the request really used """
+        with self._lock:
+            self._prune(time.time())
+            entry = self._entries.get(entry_id)
+            if entry is not None:
+                self._window_tokens += actual_tokens - entry[2]
+                entry[2] = actual_tokens
+
+    def rate_limited(self, retry_after=0):
+        """ Pauses every reservation with an exponential backoff, returns the pause in seconds """
+        with self._lock:
+            self._backoff = min(max(self._backoff * 2, 1), 60)
+            delay = max(retry_after, self._backoff * (1 + random.random()))
+            self._pause_until = max(self._pause_until, time.time() + delay)
+            return delay
+
+    def succeeded(self):
+        with self._lock:
+            self._backoff = 0
+
+
+class RateBudgetManager(BaseManager):
+    pass
+
+
+RateBudgetManager.register("RateBudget", RateBudget)
+
+
+def start_shared_rate_budget(requests_per_minute, tokens_per_minute):
+    """
+    Starts a manager process holding one RateBudget and returns (manager, budget proxy). The proxy can be
+    passed to child processes, which hand it to llm.use_rate_budget.
+    """
+    # spawn rather than fork, the web app has threads running that a forked child would inherit locked
+    manager = RateBudgetManager(ctx=multiprocessing.get_context("spawn"))
+    manager.start()
+    return manager, manager.RateBudget(requests_per_minute, tokens_per_minute)
@@ -0,0 +1,706 @@
+import copy
+import json
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+
+import dictdatabase as DDB
+try:
+    # private to dictdatabase, checked against the pinned 2.5 releases
+    from dictdatabase.configuration import Confuguration
+except ImportError:
+    Confuguration = None
+
+
+SQLITE_FILENAME = "scienceai.sqlite"
+LOG_SEGMENT_BYTES = 4 * 1024 * 1024
+
+# documents shared by the whole project
+PROJECT_DOCUMENTS = ["metadata", "update_time", "paper_index", "ingest_manifest", "paper_versions"]
+
+
+class AppendLog(ABC):
+    """
+    Append only list of records such as chat messages. Every write appends an entry carrying the record's
+    sequence number and a version; a later entry for the same sequence replaces the record, so updating
+    the last record is also an append. The folded records are kept in memory and only entries written
+    since the last read are loaded, by this or another process.
+    """
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._records = []
+        self._versions = []
+        self._version = 0
+        self._cleared_version = 0
+
+    @abstractmethod
+    def _refresh(self):
+        """ Applies the entries written since the last refresh """
+
+    @abstractmethod
+    def _write_entry(self, entry):
+        """ Stores an entry and refreshes """
+
+    def compact(self):
+        """ Drops replaced and cleared entries from storage, only the process writing the log may call it """
+        return False
+
+    def _apply(self, entry):
+        if entry.get("clear"):
+            self._records = []
+            self._versions = []
+            self._cleared_version = entry["version"]
+        elif entry["seq"] >= len(self._records):
+            self._records.append(entry["data"])
+            self._versions.append(entry["version"])
+        else:
+            self._records[entry["seq"]] = entry["data"]
+            self._versions[entry["seq"]] = entry["version"]
+        # a compacted log holds its entries in sequence rather than version order
+        self._version = max(self._version, entry["version"])
+
+    def append(self, data):
+        with self._lock:
+            self._refresh()
+            seq = len(self._records)
+            self._write_entry({"seq": seq, "version": self._version + 1, "data": data})
+            return seq
+
+    def update_last(self, data):
+        with self._lock:
+            self._refresh()
+            if not self._records:
+                return False
+            self._write_entry({"seq": len(self._records) - 1, "version": self._version + 1, "data": data})
+            return True
+
+    def clear(self):
+        with self._lock:
+            self._refresh()
+            self._write_entry({"seq": 0, "version": self._version + 1, "clear": True})
+
+    def read(self):
+        with self._lock:
+            self._refresh()
+            return copy.deepcopy(self._records)
+
+    def read_since(self, version):
+        """
+        Returns (version, changes, complete) where changes are the (seq, record) pairs appended or replaced after
+        the given version. complete is True when changes hold every record because the caller has nothing to
+        build on, either a version of 0 or one from before the log was last cleared.
+        """
+        with self._lock:
+            self._refresh()
+            complete = version <= 0 or version < self._cleared_version or version > self._version
+            changes = [(seq, copy.deepcopy(record))
+                       for seq, (record, record_version) in enumerate(zip(self._records, self._versions))
+                       if complete or record_version > version]
+            return self._version, changes, complete
+
+    def last(self):
+        with self._lock:
+            self._refresh()
+            if not self._records:
+                return None
+            return copy.deepcopy(self._records[-1])
+
+    def __len__(self):
+        with self._lock:
+            self._refresh()
+            return len(self._records)
+
+
+class JSONLinesLog(AppendLog):
+    """
+    AppendLog stored as numbered JSON lines segment files in a directory. Updating the last record appends a
+    full copy of it, so the writer compacts the log into a single segment when it opens the project.
+    """
+    def __init__(self, directory):
+        super().__init__()
+        self.directory = directory
+        self._segment = 0
+        self._offset = 0
+        self._entries = 0
+
+    def _segments(self):
+        if not os.path.exists(self.directory):
+            return []
+        return sorted(int(file[len("segment-"):-len(".jsonl")]) for file in os.listdir(self.directory)
+                      if file.startswith("segment-") and file.endswith(".jsonl"))
+
+    def _segment_path(self, number):
+        return os.path.join(self.directory, f"segment-{number:06d}.jsonl")
+
+    def _refresh(self):
+        for number in self._segments():
+            if number < self._segment:
+                continue
+            if number > self._segment:
+                self._segment = number
+                self._offset = 0
+            try:
+                with open(self._segment_path(number), "rb") as file:
+                    file.seek(self._offset)
+                    chunk = file.read()
+            except FileNotFoundError:
+                # compacted away, its records are in a later segment
+                continue
+            # a line without its newline is still being written
+            end = chunk.rfind(b"\n")
+            if end < 0:
+                continue
+            for line in chunk[:end].splitlines():
+                self._apply(json.loads(line))
+                self._entries += 1
+            self._offset += end + 1
+
+    def _write_entry(self, entry):
+        segments = self._segments()
+        number = segments[-1] if segments else 1
+        if os.path.exists(self._segment_path(number)) and \
+                os.path.getsize(self._segment_path(number)) >= LOG_SEGMENT_BYTES:
+            number += 1
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self._segment_path(number), "ab") as file:
+            file.write(json.dumps(entry).encode("utf-8") + b"\n")
+        self._refresh()
+
+    def compact(self):
+        """
+        Rewrites the log as one entry per record in a new segment and removes the old segments. Readers in other
+        processes move on to the new segment and apply its entries again, which leaves their records unchanged.
+        """
+        with self._lock:
+            self._refresh()
+            entries = [{"seq": seq, "version": version, "data": record}
+                       for seq, (record, version) in enumerate(zip(self._records, self._versions))]
+            if self._cleared_version:
+                entries.insert(0, {"seq": 0, "version": self._cleared_version, "clear": True})
+            if self._entries <= len(entries):
+                return False
+            segments = self._segments()
+            number = segments[-1] + 1
+            content = b"".join(json.dumps(entry).encode("utf-8") + b"\n" for entry in entries)
+            # another process may be compacting the same log, each writes its own temp file and removes
+            # whichever old segments are still there
+            temp_path = f"{self._segment_path(number)}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, "wb") as file:
+                file.write(content)
+            os.replace(temp_path, self._segment_path(number))
+            for old in segments:
+                try:
+                    os.remove(self._segment_path(old))
+                except FileNotFoundError:
+                    pass
+            self._segment = number
+            self._offset = len(content)
+            self._entries = len(entries)
+            return True
+
+
+ddb_directory = threading.local()
+THREAD_LOCAL_DDB_CONFIG = False
+
+if Confuguration is not None and type(DDB.config) is Confuguration:
+    class ThreadLocalConfiguration(Confuguration):
+        """
+        dictdatabase reads its storage directory from one global config object at every call. With this class that
+        object holds a directory per thread, so DDB calls for different projects on different threads do not
+        redirect each other.
+        """
+        __slots__ = ()
+
+        @property
+        def storage_directory(self):
+            return getattr(ddb_directory, "path", "ddb_storage")
+
+        @storage_directory.setter
+        def storage_directory(self, path):
+            ddb_directory.path = path
+
+    DDB.config.__class__ = ThreadLocalConfiguration
+    THREAD_LOCAL_DDB_CONFIG = True
+else:
+    print("dictdatabase's config can not be made thread local, DDB calls for all projects will share one lock")
+
+ddb_locks = {}
+ddb_locks_lock = threading.Lock()
+
+
+def ddb_lock(db_path):
+    """
+    Returns the lock serializing this process's DDB calls on one storage directory, other directories run freely.
+    Without the thread local config the storage directory is global, so every directory gets the same lock.
+    """
+    if not THREAD_LOCAL_DDB_CONFIG:
+        db_path = None
+    with ddb_locks_lock:
+        if db_path not in ddb_locks:
+            ddb_locks[db_path] = threading.RLock()
+        return ddb_locks[db_path]
+
+
+class DDBTransaction:
+    """
+    Documents loaded and changed during a DDBStorage transaction. Changes stay in memory and every changed
+    document is written once when the transaction commits; nothing is written if it fails.
+    """
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.documents = {}
+        self.changed = set()
+
+    def document(self, name):
+        """ Returns the buffered document, None if it does not exist """
+        if name not in self.documents:
+            with ddb_lock(self.db_path):
+                DDB.config.storage_directory = self.db_path
+                self.documents[name] = DDB.at(name).read() if DDB.at(name).exists() else None
+        return self.documents[name]
+
+    def store(self, name, data):
+        self.documents[name] = data
+        self.changed.add(name)
+
+    def commit(self):
+        with ddb_lock(self.db_path):
+            DDB.config.storage_directory = self.db_path
+            for name in sorted(self.changed):
+                if self.documents[name] is None:
+                    if DDB.at(name).exists():
+                        DDB.at(name).delete()
+                else:
+                    DDB.at(name).create(self.documents[name], force_overwrite=True)
+        self.changed = set()
+
+
+class DDBTransactionSession:
+    """ Session on a private copy of a buffered document, write() copies it back into the transaction """
+    def __init__(self, document, transaction, data):
+        self.document = document
+        self.transaction = transaction
+        self.data = data
+
+    def write(self):
+        data = copy.deepcopy(self.data)
+        if self.document.key is None:
+            self.transaction.store(self.document.name, data)
+        else:
+            full = self.transaction.document(self.document.name)
+            full[self.document.key] = data
+            self.transaction.store(self.document.name, full)
+
+
+class DDBDocument:
+    """
+    A DDB.at() handle that points the calling thread's DDB config at its own project for every call. Inside a
+    transaction it works on the transaction's buffered copy of the document instead.
+    """
+    def __init__(self, db_path, name, key=None, transaction=None):
+        self.db_path = db_path
+        self.name = name
+        self.key = key
+        self.transaction = transaction
+        self._lock = ddb_lock(db_path)
+
+    def _at(self):
+        DDB.config.storage_directory = self.db_path
+        return DDB.at(self.name, key=self.key)
+
+    def exists(self):
+        if self.transaction is not None:
+            document = self.transaction.document(self.name)
+            return document is not None and (self.key is None or self.key in document)
+        with self._lock:
+            return self._at().exists()
+
+    def read(self):
+        if self.transaction is not None:
+            document = self.transaction.document(self.name)
+            if document is not None and self.key is not None:
+                document = document.get(self.key)
+            return copy.deepcopy(document)
+        with self._lock:
+            return self._at().read()
+
+    def create(self, data=None, force_overwrite=False):
+        if self.transaction is not None:
+            if self.key is not None:
+                raise RuntimeError("create() cannot be used with the key parameter")
+            if not force_overwrite and self.exists():
+                raise FileExistsError(f"Database {self.name} already exists in {self.db_path}.")
+            self.transaction.store(self.name, copy.deepcopy(data) if data is not None else {})
+            return
+        with self._lock:
+            return self._at().create(data, force_overwrite=force_overwrite)
+
+    def delete(self):
+        if self.transaction is not None:
+            self.transaction.store(self.name, None)
+            return
+        with self._lock:
+            return self._at().delete()
+
+    @contextmanager
+    def session(self):
+        if self.transaction is not None:
+            document = self.transaction.document(self.name)
+            if document is None:
+                raise FileNotFoundError(f"Database {self.name} does not exist in {self.db_path}.")
+            # like a DDB session, edits only count once written, even if the session raises or never writes
+            data = copy.deepcopy(document if self.key is None else document.get(self.key))
+            yield DDBTransactionSession(self, self.transaction, data), data
+            return
+        with self._lock:
+            with self._at().session() as (session, data):
+                yield session, data
+
+
+class DDBStorage:
+    """ Storage engine keeping every document as a dictdatabase JSON file under db_path """
+    engine = "ddb"
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        if not os.path.exists(self.db_path):
+            os.makedirs(self.db_path)
+        self._logs = {}
+        self._logs_lock = threading.Lock()
+        self._local = threading.local()
+
+    def log(self, name):
+        with self._logs_lock:
+            if name not in self._logs:
+                self._logs[name] = JSONLinesLog(os.path.join(self.db_path, "logs", name))
+            return self._logs[name]
+
+    def at(self, name, key=None, table=None):
+        """ Every document is its own file, table is accepted for the SQLite engine's sake and ignored """
+        return DDBDocument(self.db_path, name, key=key, transaction=getattr(self._local, "transaction", None))
+
+    @contextmanager
+    def transaction(self):
+        """ Buffers the documents this thread changes and writes each of them once at the end """
+        if getattr(self._local, "transaction", None) is not None:
+            yield
+            return
+        self._local.transaction = DDBTransaction(self.db_path)
+        try:
+            yield
+            self._local.transaction.commit()
+        finally:
+            self._local.transaction = None
+
+    def file_path(self, name):
+        return os.path.join(self.db_path, name + ".json")
+
+    def materialize(self, name, table=None):
+        return self.file_path(name)
+
+    def checkpoint(self):
+        pass
+
+    def close(self):
+        pass
+
+
+SQLITE_TABLES = ["papers", "chat", "analysts", "contexts", "trackers", "paper_documents", "documents", "extractions"]
+# tables of the documents with fixed names, any other document is opened with the table it belongs to
+SQLITE_NAMED_TABLES = {"papers": "papers", "chat": "chat", "Analysts": "analysts",
+                       **{name: "documents" for name in PROJECT_DOCUMENTS}}
+
+
+def sqlite_table_for(name, table=None):
+    if table is None:
+        table = SQLITE_NAMED_TABLES.get(name)
+    if table not in SQLITE_TABLES:
+        raise ValueError(f"No SQLite table for document {name}, pass one of {SQLITE_TABLES}")
+    return table
+
+
+class SQLiteSession:
+    def __init__(self, document, data, original):
+        self.document = document
+        self.data = data
+        self.original = original
+
+    def write(self):
+        self.document._write(self.data, self.original)
+        if self.document.key is None:
+            self.original = {k: json.dumps(v) for k, v in self.data.items()}
+        else:
+            self.original = json.dumps(self.data)
+
+
+class SQLiteDocument:
+    """ Mirrors the part of the DDB.at() API used by the DatabaseManager, one row per top level key """
+    def __init__(self, storage, name, key=None, table=None):
+        self.storage = storage
+        self.name = name
+        self.key = key
+        self.table = sqlite_table_for(name, table)
+
+    def exists(self):
+        connection = self.storage.connection()
+        if self.key is None:
+            row = connection.execute("SELECT 1 FROM names WHERE name = ?", (self.name,)).fetchone()
+        else:
+            row = connection.execute(f"SELECT 1 FROM {self.table} WHERE name = ? AND key = ?",
+                                     (self.name, self.key)).fetchone()
+        return row is not None
+
+    def read(self):
+        connection = self.storage.connection()
+        if self.key is not None:
+            row = connection.execute(f"SELECT value FROM {self.table} WHERE name = ? AND key = ?",
+                                     (self.name, self.key)).fetchone()
+            return json.loads(row[0]) if row else None
+        if not self.exists():
+            return None
+        rows = connection.execute(f"SELECT key, value FROM {self.table} WHERE name = ? ORDER BY rowid",
+                                  (self.name,)).fetchall()
+        return {key: json.loads(value) for key, value in rows}
+
+    def create(self, data=None, force_overwrite=False):
+        if self.key is not None:
+            raise RuntimeError("create() cannot be used with the key parameter")
+        with self.storage.transaction() as connection:
+            if not force_overwrite and self.exists():
+                raise FileExistsError(f"Database {self.name} already exists in {self.storage.sqlite_path}.")
+            connection.execute(f"DELETE FROM {self.table} WHERE name = ?", (self.name,))
+            connection.execute("INSERT OR IGNORE INTO names (name) VALUES (?)", (self.name,))
+            connection.executemany(f"INSERT INTO {self.table} (name, key, value) VALUES (?, ?, ?)",
+                                   [(self.name, k, json.dumps(v)) for k, v in (data or {}).items()])
+
+    def delete(self):
+        with self.storage.transaction() as connection:
+            connection.execute(f"DELETE FROM {self.table} WHERE name = ?", (self.name,))
+            connection.execute("DELETE FROM names WHERE name = ?", (self.name,))
+
+    @contextmanager
+    def session(self):
+        with self.storage.transaction():
+            data = self.read()
+            if data is None and self.key is None:
+                raise FileNotFoundError(f"Database {self.name} does not exist in {self.storage.sqlite_path}.")
+            if self.key is None:
+                original = {k: json.dumps(v) for k, v in data.items()}
+            else:
+                original = json.dumps(data)
+            yield SQLiteSession(self, data, original), data
+
+    def _upsert(self, connection, key, value):
+        connection.execute(f"INSERT INTO {self.table} (name, key, value) VALUES (?, ?, ?) "
+                           f"ON CONFLICT (name, key) DO UPDATE SET value = excluded.value", (self.name, key, value))
+
+    def _write(self, data, original):
+        connection = self.storage.connection()
+        connection.execute("INSERT OR IGNORE INTO names (name) VALUES (?)", (self.name,))
+        if self.key is not None:
+            value = json.dumps(data)
+            if value != original:
+                self._upsert(connection, self.key, value)
+            return
+        # only rows whose value changed are rewritten, so editing one paper costs one row not the whole file
+        for key, value in data.items():
+            value = json.dumps(value)
+            if original.get(key) != value:
+                self._upsert(connection, key, value)
+        for key in original:
+            if key not in data:
+                connection.execute(f"DELETE FROM {self.table} WHERE name = ? AND key = ?", (self.name, key))
+
+
+class SQLiteLog(AppendLog):
+    """ AppendLog stored as rows of the logs table, log_heads holds each log's version and the version it was cleared at """
+    def __init__(self, storage, name):
+        super().__init__()
+        self.storage = storage
+        self.name = name
+        self._epoch = 0
+
+    def _refresh(self):
+        connection = self.storage.connection()
+        head = connection.execute("SELECT epoch, version FROM log_heads WHERE name = ?", (self.name,)).fetchone()
+        if head is None:
+            return
+        epoch, version = head
+        if epoch != self._epoch:
+            # the epoch is the version the log was last cleared at
+            self._epoch = epoch
+            self._records = []
+            self._versions = []
+            self._version = 0
+            self._cleared_version = epoch
+        if version == self._version:
+            return
+        rows = connection.execute("SELECT seq, version, value FROM logs WHERE name = ? AND version > ? "
+                                  "ORDER BY version", (self.name, self._version)).fetchall()
+        for seq, row_version, value in rows:
+            self._apply({"seq": seq, "version": row_version, "data": json.loads(value)})
+        self._version = version
+
+    def _write_entry(self, entry):
+        with self.storage.transaction() as connection:
+            connection.execute("INSERT OR IGNORE INTO log_heads (name, epoch, version) VALUES (?, 0, 0)",
+                               (self.name,))
+            if entry.get("clear"):
+                connection.execute("DELETE FROM logs WHERE name = ?", (self.name,))
+                connection.execute("UPDATE log_heads SET epoch = ?, version = ? WHERE name = ?",
+                                   (entry["version"], entry["version"], self.name))
+            else:
+                connection.execute("UPDATE log_heads SET version = ? WHERE name = ?", (entry["version"], self.name))
+                connection.execute("INSERT INTO logs (name, seq, version, value) VALUES (?, ?, ?, ?) "
+                                   "ON CONFLICT (name, seq) DO UPDATE SET version = excluded.version, "
+                                   "value = excluded.value",
+                                   (self.name, entry["seq"], entry["version"], json.dumps(entry["data"])))
+        self._refresh()
+
+
+class SQLiteStorage:
+    """
+    Storage engine keeping every document in a single SQLite database in WAL mode. Documents are split into a
+    row per top level key, so a session that changes one paper or one analyst only rewrites that row.
+    """
+    engine = "sqlite"
+
+    def __init__(self, sqlite_path, db_path=None):
+        self.sqlite_path = sqlite_path
+        self.db_path = db_path or os.path.dirname(sqlite_path)
+        self._local = threading.local()
+        self._logs = {}
+        self._logs_lock = threading.Lock()
+        with self.transaction() as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS names (name TEXT PRIMARY KEY)")
+            connection.execute("CREATE TABLE IF NOT EXISTS logs (name TEXT NOT NULL, seq INTEGER NOT NULL, "
+                               "version INTEGER NOT NULL, value TEXT NOT NULL, PRIMARY KEY (name, seq))")
+            connection.execute("CREATE TABLE IF NOT EXISTS log_heads (name TEXT PRIMARY KEY, epoch INTEGER NOT NULL, "
+                               "version INTEGER NOT NULL)")
+            for table in SQLITE_TABLES:
+                connection.execute(f"CREATE TABLE IF NOT EXISTS {table} (name TEXT NOT NULL, key TEXT NOT NULL, "
+                                   f"value TEXT NOT NULL, PRIMARY KEY (name, key))")
+
+    def connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.sqlite_path, timeout=60, isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            self._local.depth = 0
+        return connection
+
+    @contextmanager
+    def transaction(self):
+        connection = self.connection()
+        # nested sessions on the same thread join the outer transaction
+        if self._local.depth == 0:
+            connection.execute("BEGIN IMMEDIATE")
+        self._local.depth += 1
+        try:
+            yield connection
+        except BaseException:
+            self._local.depth -= 1
+            if self._local.depth == 0:
+                connection.execute("ROLLBACK")
+            raise
+        self._local.depth -= 1
+        if self._local.depth == 0:
+            connection.execute("COMMIT")
+
+    def at(self, name, key=None, table=None):
+        """ table is the SQLite table the document lives in, only documents with fixed names may leave it out """
+        return SQLiteDocument(self, name, key=key, table=table)
+
+    def log(self, name):
+        with self._logs_lock:
+            if name not in self._logs:
+                self._logs[name] = SQLiteLog(self, name)
+            return self._logs[name]
+
+    def is_empty(self):
+        return self.connection().execute("SELECT 1 FROM names LIMIT 1").fetchone() is None
+
+    def file_path(self, name):
+        return os.path.join(self.db_path, name + ".json")
+
+    def materialize(self, name, table=None):
+        """ Writes a document out as JSON at the path the DDB engine would use, for downloads and viewers """
+        data = self.at(name, table=table).read()
+        path = self.file_path(name)
+        if data is None:
+            return path
+        content = json.dumps(data, indent="\t").encode("utf-8")
+        if os.path.exists(path):
+            with open(path, "rb") as file:
+                # an unchanged document keeps its mtime so browsers can revalidate their cached copy
+                if file.read() == content:
+                    return path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as file:
+            file.write(content)
+        os.replace(temp_path, path)
+        return path
+
+    def checkpoint(self):
+        self.connection().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def close(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+
+def ddb_document_tables(db_path):
+    """ Maps the names of a DDB project's papers, analysts, and trackers to their SQLite tables """
+    def load(name):
+        path = os.path.join(db_path, name + ".json")
+        if not os.path.exists(path):
+            return {}
+        with open(path, "r") as file:
+            return json.load(file)
+    tables = {paper_id: "paper_documents" for paper_id in load("papers")}
+    for analyst_name, analyst in load("Analysts").items():
+        tables[analyst_name] = "contexts"
+        for tool in analyst.get("tools", []):
+            tables[tool["json_path"][:-len(".json")]] = "trackers"
+    return tables
+
+
+def migrate_ddb_to_sqlite(db_path, sqlite_path):
+    """ One shot copy of every dictdatabase JSON document and JSON lines log under db_path into a SQLite database """
+    storage = SQLiteStorage(sqlite_path, db_path=db_path)
+    tables = ddb_document_tables(db_path)
+    migrated = 0
+    log_root = os.path.join(db_path, "logs")
+    with storage.transaction():
+        for root, dirs, files in os.walk(db_path):
+            if os.path.commonpath([root, log_root]) == log_root:
+                if any(file.endswith(".jsonl") for file in files):
+                    name = os.path.relpath(root, log_root).replace(os.sep, "/")
+                    log = storage.log(name)
+                    log.clear()
+                    for record in JSONLinesLog(root).read():
+                        log.append(record)
+                    migrated += 1
+                continue
+            for file in files:
+                if not file.endswith(".json"):
+                    continue
+                full_path = os.path.join(root, file)
+                name = os.path.relpath(full_path, db_path)[:-len(".json")].replace(os.sep, "/")
+                table = "extractions" if name.startswith("extractions/") else tables.get(name)
+                if table is None and name not in SQLITE_NAMED_TABLES:
+                    print(f"Skipping {full_path}, no project document refers to it")
+                    continue
+                with open(full_path, "r") as f:
+                    data = json.load(f)
+                storage.at(name, table=table).create(data, force_overwrite=True)
+                migrated += 1
+    print(f"Migrated {migrated} documents from {db_path} to {sqlite_path}")
+    return storage
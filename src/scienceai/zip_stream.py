@@ -0,0 +1,67 @@
+import io
+import os
+import zipfile
+
+
+ZIP_CHUNK_BYTES = 1024 * 1024
+
+
+class ZipStreamBuffer(io.RawIOBase):
+    """ Write only, unseekable file that collects what zipfile writes until the stream drains it """
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def folder_entries(folder, archive_root):
+    """ Lists (archive name, path) for a folder and everything under it, folders included, for stream_zip """
+    entries = []
+    for root, dirs, files in os.walk(folder):
+        relative_root = os.path.relpath(root, folder)
+        archive_folder = archive_root if relative_root == "." else os.path.join(archive_root, relative_root)
+        entries.append((archive_folder, root))
+        for file in sorted(files):
+            entries.append((os.path.join(archive_folder, file), os.path.join(root, file)))
+    return entries
+
+
+def stream_zip(entries, compression=zipfile.ZIP_DEFLATED):
+    """
+    Yields a zip archive of the (archive name, path) entries as it is built, reading each file straight from
+    its path, so nothing is staged on disk and the first bytes are sent right away. Files that disappear
+    before they are reached are left out.
+    """
+    buffer = ZipStreamBuffer()
+    with zipfile.ZipFile(buffer, "w", compression=compression, allowZip64=True) as archive:
+        for archive_name, path in entries:
+            archive_name = archive_name.replace(os.sep, "/")
+            if os.path.isdir(path):
+                archive.writestr(zipfile.ZipInfo.from_file(path, archive_name), b"")
+                continue
+            try:
+                source = open(path, "rb")
+            except FileNotFoundError:
+                continue
+            with source:
+                info = zipfile.ZipInfo.from_file(path, archive_name)
+                info.compress_type = compression
+                with archive.open(info, "w") as target:
+                    for chunk in iter(lambda: source.read(ZIP_CHUNK_BYTES), b""):
+                        target.write(chunk)
+                        data = buffer.drain()
+                        if data:
+                            yield data
+            yield buffer.drain()
+    yield buffer.drain()
@@ -0,0 +1,61 @@
+import threading
+import time
+
+from scienceai import change_feed
+from scienceai.change_feed import ChangeFeed
+
+UPDATE_TIME = "2026-10-18 12:00:00"
+
+
+def test_feeds_are_shared_per_path(tmp_path):
+    assert ChangeFeed.for_path(str(tmp_path / "changes")) is ChangeFeed.for_path(str(tmp_path / "changes") + "/")
+    assert ChangeFeed.for_path(str(tmp_path / "changes")) is not ChangeFeed.for_path(str(tmp_path / "other"))
+
+
+def test_wait_wakes_on_notify_in_the_same_process(tmp_path):
+    feed = ChangeFeed(str(tmp_path / "changes"))
+    since = feed.versions()
+    woken = {}
+
+    def wait():
+        woken["versions"] = feed.wait(since, ["chat"], timeout=10)
+        woken["at"] = time.time()
+
+    waiter = threading.Thread(target=wait)
+    waiter.start()
+    time.sleep(0.1)
+    notified_at = time.time()
+    feed.notify(["chat"], UPDATE_TIME)
+    waiter.join(10)
+    assert woken["versions"]["chat"] == since["chat"] + 1
+    assert woken["versions"]["papers"] == since["papers"]
+    # the condition variable wakes the waiter, it does not wait for a poll
+    assert woken["at"] - notified_at < 1
+
+
+def test_wait_ignores_other_collections(tmp_path):
+    feed = ChangeFeed(str(tmp_path / "changes"))
+    since = feed.versions()
+    feed.notify(["papers"], UPDATE_TIME)
+    assert feed.wait(since, ["chat"], timeout=0.2)["chat"] == since["chat"]
+
+
+def test_watching_feed_wakes_on_another_feeds_changes(tmp_path, monkeypatch):
+    monkeypatch.setattr(change_feed, "POLL_INTERVAL", 0.05)
+    # two feeds on one path stand in for the backend and the web app, which only share the marker files
+    writer = ChangeFeed(str(tmp_path / "changes"))
+    reader = ChangeFeed(str(tmp_path / "changes"))
+    reader.watch_files = True
+    since = reader.versions()
+    notifier = threading.Timer(0.2, writer.notify, args=(["papers"], UPDATE_TIME))
+    notifier.start()
+    versions = reader.wait(since, ["papers"], timeout=10)
+    notifier.join()
+    assert versions["papers"] == since["papers"] + 1
+    assert versions["chat"] == since["chat"]
+    assert reader.last_update_time() == UPDATE_TIME
+    # a feed that does not watch the files only sees changes made through itself
+    unwatched = ChangeFeed(str(tmp_path / "changes"))
+    since = unwatched.versions()
+    writer.notify(["papers"], UPDATE_TIME)
+    assert unwatched.wait(since, ["papers"], timeout=0.2) == since
@@ -0,0 +1,110 @@
+import os
+import shutil
+import threading
+
+from scienceai.checkpoint_store import CheckpointStore, file_lock
+
+
+def write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as file:
+        file.write(content)
+
+
+def read(path):
+    with open(path, "r") as file:
+        return file.read()
+
+
+def objects(store):
+    return sorted(filename for root, dirs, filenames in os.walk(store.objects_path) for filename in filenames)
+
+
+def make_project(tmp_path):
+    source = str(tmp_path / "project")
+    write(os.path.join(source, "a.txt"), "same")
+    write(os.path.join(source, "b.txt"), "same")
+    write(os.path.join(source, "papers", "c.txt"), "other")
+    return source
+
+
+def test_snapshot_stores_each_content_once(tmp_path, capsys):
+    source = make_project(tmp_path)
+    store = CheckpointStore(str(tmp_path / "store"))
+    first = store.snapshot(source, str(tmp_path / "first"))
+    assert len(objects(store)) == 2
+    assert read(os.path.join(first, "b.txt")) == "same"
+    assert read(os.path.join(first, "papers", "c.txt")) == "other"
+    assert "3 of 3 files stored" in capsys.readouterr().out
+    # unchanged files are taken from the previous manifest without hashing them again
+    store.snapshot(source, str(tmp_path / "second"), previous="first")
+    assert "0 of 3 files stored" in capsys.readouterr().out
+    assert len(objects(store)) == 2
+    assert store.read_manifest("second") == store.read_manifest("first")
+
+
+def test_restore_gives_back_the_snapshotted_project(tmp_path):
+    source = make_project(tmp_path)
+    store = CheckpointStore(str(tmp_path / "store"))
+    checkpoint = store.snapshot(source, str(tmp_path / "checkpoint"))
+    # files are edited in place and removed after the checkpoint, neither may reach it
+    with open(os.path.join(source, "a.txt"), "r+") as file:
+        file.write("edit")
+    os.remove(os.path.join(source, "papers", "c.txt"))
+    assert read(os.path.join(checkpoint, "a.txt")) == "same"
+    shutil.rmtree(source)
+    shutil.copytree(checkpoint, source)
+    assert read(os.path.join(source, "a.txt")) == "same"
+    assert read(os.path.join(source, "papers", "c.txt")) == "other"
+    # the restored project is a copy, editing it leaves the checkpoint alone
+    write(os.path.join(source, "b.txt"), "changed")
+    assert read(os.path.join(checkpoint, "b.txt")) == "same"
+
+
+def test_delete_collects_only_unreferenced_objects(tmp_path):
+    source = make_project(tmp_path)
+    store = CheckpointStore(str(tmp_path / "store"))
+    with store.lock():
+        first = store.snapshot(source, str(tmp_path / "first"))
+    write(os.path.join(source, "a.txt"), "new")
+    os.remove(os.path.join(source, "papers", "c.txt"))
+    with store.lock():
+        second = store.snapshot(source, str(tmp_path / "second"), previous="first")
+        assert len(objects(store)) == 3
+        store.delete(first)
+    assert not os.path.exists(first)
+    assert not os.path.exists(store.manifest_path("first"))
+    # "other" was only in the deleted checkpoint, "same" is still linked from the second one
+    assert objects(store) == sorted({entry["sha256"] for entry in store.read_manifest("second")["files"].values()})
+    assert len(objects(store)) == 2
+    assert read(os.path.join(second, "a.txt")) == "new"
+    assert read(os.path.join(second, "b.txt")) == "same"
+    assert store.collect_garbage() == 0
+
+
+def test_file_lock_excludes_other_threads(tmp_path):
+    path = str(tmp_path / "lock")
+    locked = threading.Event()
+    release = threading.Event()
+    acquired = threading.Event()
+
+    def hold():
+        with file_lock(path):
+            locked.set()
+            release.wait(10)
+
+    def take():
+        with file_lock(path):
+            acquired.set()
+
+    holder = threading.Thread(target=hold)
+    holder.start()
+    assert locked.wait(10)
+    taker = threading.Thread(target=take)
+    taker.start()
+    # a snapshot and a garbage sweep holding the store lock may not overlap
+    assert not acquired.wait(0.3)
+    release.set()
+    assert acquired.wait(10)
+    holder.join()
+    taker.join()
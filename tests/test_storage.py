@@ -0,0 +1,83 @@
+import os
+import threading
+
+from scienceai.storage import DDBStorage, THREAD_LOCAL_DDB_CONFIG, ddb_lock
+
+
+def test_ddb_projects_write_at_the_same_time(tmp_path):
+    first = DDBStorage(str(tmp_path / "first"))
+    second = DDBStorage(str(tmp_path / "second"))
+    first.at("papers").create({})
+    second.at("papers").create({})
+    in_session = threading.Event()
+    release = threading.Event()
+
+    def hold_session():
+        with first.at("papers").session() as (session, papers):
+            papers["held"] = "first"
+            in_session.set()
+            release.wait(10)
+            session.write()
+
+    holder = threading.Thread(target=hold_session)
+    holder.start()
+    assert in_session.wait(10)
+    # a session open on one project must not hold up writes to another
+    writer = threading.Thread(target=lambda: second.at("metadata").create({"project": "second"}))
+    writer.start()
+    writer.join(5)
+    finished = not writer.is_alive()
+    release.set()
+    holder.join()
+    writer.join()
+    assert finished
+    assert first.at("papers").read() == {"held": "first"}
+    assert not first.at("metadata").exists()
+    assert second.at("metadata").read() == {"project": "second"}
+
+
+def test_ddb_projects_do_not_cross_over(tmp_path):
+    storages = {name: DDBStorage(str(tmp_path / name)) for name in ["first", "second", "third"]}
+
+    def write(name):
+        for i in range(30):
+            storages[name].at(f"document_{i}").create({"project": name, "index": i})
+
+    threads = [threading.Thread(target=write, args=(name,)) for name in storages]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for name, storage in storages.items():
+        assert sorted(file for file in os.listdir(storage.db_path) if file.endswith(".json")) == \
+            sorted(f"document_{i}.json" for i in range(30))
+        for i in range(30):
+            assert storage.at(f"document_{i}").read() == {"project": name, "index": i}
+
+
+def test_ddb_transaction_keeps_only_written_sessions(tmp_path):
+    storage = DDBStorage(str(tmp_path / "project"))
+    storage.at("papers").create({"a": {"title": "A"}})
+    with storage.transaction():
+        with storage.at("papers").session() as (session, papers):
+            papers["b"] = {"title": "B"}
+            session.write()
+        with storage.at("papers").session() as (session, papers):
+            papers["never_written"] = {}
+        try:
+            with storage.at("papers", key="a").session() as (session, paper):
+                paper["title"] = "changed"
+                raise ValueError
+        except ValueError:
+            pass
+        assert storage.at("papers").read() == {"a": {"title": "A"}, "b": {"title": "B"}}
+    assert storage.at("papers").read() == {"a": {"title": "A"}, "b": {"title": "B"}}
+
+
+def test_ddb_lock_is_per_directory_only_with_the_thread_local_config(monkeypatch):
+    assert THREAD_LOCAL_DDB_CONFIG
+    assert ddb_lock("first") is ddb_lock("first")
+    assert ddb_lock("first") is not ddb_lock("second")
+    # without it every directory shares the one global storage directory, so they share one lock
+    monkeypatch.setattr("scienceai.storage.THREAD_LOCAL_DDB_CONFIG", False)
+    assert ddb_lock("first") is ddb_lock("second")
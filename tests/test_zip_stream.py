@@ -0,0 +1,45 @@
+import io
+import os
+import zipfile
+
+from scienceai import zip_stream
+from scienceai.zip_stream import folder_entries, stream_zip
+
+
+def write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as file:
+        file.write(content)
+
+
+def test_stream_zip_round_trips_through_zipfile(tmp_path, monkeypatch):
+    # small chunks so a file is streamed over several reads
+    monkeypatch.setattr(zip_stream, "ZIP_CHUNK_BYTES", 1024)
+    folder = str(tmp_path / "export")
+    files = {
+        "summary.csv": b"paper,value\na,1\nb,2\n",
+        os.path.join("papers", "a.pdf"): os.urandom(10000),
+        os.path.join("papers", "empty.txt"): b"",
+    }
+    for name, content in files.items():
+        write(os.path.join(folder, name), content)
+    os.makedirs(os.path.join(folder, "no_files"))
+
+    chunks = list(stream_zip(folder_entries(folder, "export")))
+    assert len([chunk for chunk in chunks if chunk]) > 2
+    with zipfile.ZipFile(io.BytesIO(b"".join(chunks))) as archive:
+        assert archive.testzip() is None
+        names = archive.namelist()
+        for name, content in files.items():
+            assert archive.read("export/" + name.replace(os.sep, "/")) == content
+        assert "export/no_files/" in names
+        assert "export/papers/" in names
+
+
+def test_stream_zip_leaves_out_missing_files(tmp_path):
+    present = str(tmp_path / "present.txt")
+    write(present, b"here")
+    entries = [("present.txt", present), ("missing.txt", str(tmp_path / "missing.txt"))]
+    with zipfile.ZipFile(io.BytesIO(b"".join(stream_zip(entries, compression=zipfile.ZIP_STORED)))) as archive:
+        assert archive.namelist() == ["present.txt"]
+        assert archive.read("present.txt") == b"here"